@@ -1,15 +1,48 @@
 """可解释性API路由"""
-from fastapi import APIRouter, HTTPException, Body
-from typing import Optional, Dict, Any
+import asyncio
+from fastapi import APIRouter, HTTPException, Body, Depends
+from typing import Optional, List, Dict, Any
 from pydantic import BaseModel, Field
 
 from app.services.preprocessing import preprocessor
 from app.services.explainer import explainer
+from app.services.batching import AsyncBatcher
 from app.core.logger import logger
+from app.core.validation import json_body, json_body_openapi
 
 router = APIRouter()
 
 
+def _explain_batch(items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """批量预处理并生成综合解释"""
+    preprocessed_list = preprocessor.preprocess_batch([item['text'] for item in items])
+    return explainer.generate_comprehensive_explanation_batch([
+        {**item, 'preprocessed': preprocessed}
+        for item, preprocessed in zip(items, preprocessed_list)
+    ])
+
+
+def _attention_batch(items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """批量预处理并计算注意力解释"""
+    preprocessed_list = preprocessor.preprocess_batch([item['text'] for item in items])
+    return explainer.explain_with_gradients_batch([
+        {**item, 'tokens': preprocessed.get('tokens', [])}
+        for item, preprocessed in zip(items, preprocessed_list)
+    ])
+
+
+# 合并并发的解释请求
+# 按文本长度分桶，长短差异大的请求不进入同一批次
+explain_batcher = AsyncBatcher(
+    _explain_batch, max_batch_size=16, max_wait_ms=10,
+    length_fn=lambda item: len(item['text'])
+)
+attention_batcher = AsyncBatcher(
+    _attention_batch, max_batch_size=16, max_wait_ms=10,
+    length_fn=lambda item: len(item['text'])
+)
+
+
 class ExplainRequest(BaseModel):
     """解释请求模型"""
     text: str = Field(..., description="病例文本")
@@ -19,22 +52,18 @@ class ExplainRequest(BaseModel):
     use_graph: Optional[bool] = Field(True, description="是否使用知识图谱路径解释")
 
 
-@router.post("/", response_model=Dict[str, Any])
-async def explain_prediction(request: ExplainRequest):
+@router.post("/", response_model=Dict[str, Any], openapi_extra=json_body_openapi(ExplainRequest))
+async def explain_prediction(request: ExplainRequest = Depends(json_body(ExplainRequest))):
 
     try:
-        # 1. 预处理文本
-        preprocessed = preprocessor.preprocess(request.text)
-        
-        # 2. 生成综合解释
-        explanation = explainer.generate_comprehensive_explanation(
-            text=request.text,
-            preprocessed=preprocessed,
-            icd_code=request.icd_code,
-            probability=request.probability or 0.0,
-            use_attention=request.use_attention,
-            use_graph=request.use_graph
-        )
+        # 预处理文本并生成综合解释（与并发请求合并批处理）
+        explanation = await explain_batcher.submit({
+            'text': request.text,
+            'icd_code': request.icd_code,
+            'probability': request.probability or 0.0,
+            'use_attention': request.use_attention,
+            'use_graph': request.use_graph
+        })
         
         return {
             "success": True,
@@ -54,13 +83,11 @@ async def explain_attention(
 ):
     """使用注意力机制解释预测结果"""
     try:
-        preprocessed = preprocessor.preprocess(text)
-        
-        result = explainer.explain_with_gradients(
-            text=text,
-            tokens=preprocessed.get('tokens', []),
-            icd_code=icd_code
-        )
+        # 与并发的注意力解释请求合并批处理
+        result = await attention_batcher.submit({
+            'text': text,
+            'icd_code': icd_code
+        })
         
         return {
             "success": True,
@@ -82,10 +109,11 @@ async def explain_graph(
     try:
         entities = {}
         if text:
-            preprocessed = preprocessor.preprocess(text)
+            preprocessed = await asyncio.to_thread(preprocessor.preprocess, text)
             entities = preprocessed.get('entities', {})
         
-        result = explainer.explain_with_graph_path(
+        result = await asyncio.to_thread(
+            explainer.explain_with_graph_path,
             icd_code=icd_code,
             case_entities=entities
         )
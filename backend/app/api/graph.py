@@ -1,14 +1,21 @@
 """知识图谱API路由"""
-from fastapi import APIRouter, HTTPException, Query, Body
-from typing import Optional, List, Dict, Any
+import asyncio
+from fastapi import APIRouter, HTTPException, Query, Body, Depends
+from fastapi.responses import StreamingResponse
+from typing import Optional, List, Dict, Any, AsyncIterator
 
 from app.services.graph_manager import graph_manager
 from app.core.logger import logger
+from app.core.http_cache import etag_for
+from app.core.utils import json_dumps
 
 router = APIRouter()
 
+# 图谱数据版本号变化（重新加载）后ETag自动失效
+graph_etag = etag_for(lambda: graph_manager.generation)
 
-@router.get("/query")
+
+@router.get("/query", dependencies=[Depends(graph_etag)])
 async def query_graph(
     icd: Optional[str] = Query(None, description="ICD编码"),
     depth: int = Query(2, description="查询深度")
@@ -19,10 +26,10 @@ async def query_graph(
             raise HTTPException(status_code=400, detail="请提供ICD编码参数")
         
         # 获取相关节点和边
-        result = graph_manager.get_related_nodes(icd, depth)
+        result = await asyncio.to_thread(graph_manager.get_related_nodes, icd, depth)
         
         # 获取ICD编码基本信息
-        icd_info = graph_manager.query_icd(icd)
+        icd_info = await asyncio.to_thread(graph_manager.query_icd, icd)
         
         return {
             "icd_code": icd,
@@ -40,92 +47,106 @@ async def query_graph(
         raise HTTPException(status_code=500, detail=f"图谱查询失败: {str(e)}")
 
 
-@router.post("/visualize")
-async def visualize_graph_from_predictions(
-    predictions: Optional[Dict[str, Any]] = Body(None, description="预测结果数据")
-):
+# 实体节点ID前缀
+_ENTITY_PREFIX = "entity_"
 
-    try:
-        # 如果没有提供predictions，从icd_hierarchy.json读取最新的预测结果
-        if predictions is None:
-            predictions = graph_manager.get_latest_predictions()
-            if not predictions:
-                return {
-                    "nodes": [],
-                    "edges": [],
-                    "paths": [],
-                    "entities": {},
-                    "message": "暂无预测结果，请先运行预测"
-                }
-        
-        # 从预测结果中提取ICD编码
-        icd_predictions = predictions.get('icdPredictions', [])
-        entities = predictions.get('entities', {})
-        
-        if not icd_predictions:
+
+def _edge_key(edge: Dict[str, Any]) -> tuple:
+    """边的规范键 (source, target, type)"""
+    return (edge['source'], edge['target'], edge.get('type', ''))
+
+
+def _entity_nodes(entities: Dict[str, List[str]]) -> Dict[str, Dict[str, Any]]:
+    """构建实体节点"""
+    nodes = {}
+    for entity_type, entity_list in entities.items():
+        type_prefix = _ENTITY_PREFIX + entity_type + "_"
+        for entity in entity_list[:5]:  # 每个类型最多5个实体
+            node_id = type_prefix + entity
+            nodes.setdefault(node_id, {
+                'id': node_id,
+                'label': entity,
+                'type': entity_type,
+                'level': 0
+            })
+    return nodes
+
+
+async def _build_visualization(predictions: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """根据预测结果构建知识图谱可视化数据（GET/POST /visualize共用）"""
+    # 如果没有提供predictions，从icd_hierarchy.json读取最新的预测结果
+    if predictions is None:
+        predictions = await asyncio.to_thread(graph_manager.get_latest_predictions)
+        if not predictions:
             return {
                 "nodes": [],
                 "edges": [],
                 "paths": [],
-                "entities": entities
+                "entities": {},
+                "message": "暂无预测结果，请先运行预测"
             }
-        
-        # 重新加载数据以获取最新的层次结构
-        graph_manager.reload_data()
-        
-        # 获取top-3个ICD编码的图谱数据
-        top_icds = icd_predictions[:3]
-        
-        all_nodes = {}
-        all_edges = []
-        paths = []
-        
-        for pred in top_icds:
-            icd_code = pred.get('code', '')
-            if not icd_code:
-                continue
-            
-            # 获取ICD编码的图谱信息
-            related = graph_manager.get_related_nodes(icd_code, depth=2)
-            hierarchy_path = graph_manager.get_hierarchy_path(icd_code)
-            
-            # 合并节点
-            for node in related.get('nodes', []):
-                node_id = node.get('id', '')
-                if node_id:
-                    all_nodes[node_id] = node
-            
-            # 合并边
-            all_edges.extend(related.get('edges', []))
-            
-            # 添加路径
-            paths.append({
-                'icd_code': icd_code,
-                'icd_name': pred.get('description', ''),
-                'probability': pred.get('probability', 0.0),
-                'hierarchy_path': hierarchy_path,
-                'related_nodes': related.get('nodes', [])
-            })
-        
-        # 添加实体节点
-        for entity_type, entity_list in entities.items():
-            for entity in entity_list[:5]:  # 每个类型最多5个实体
-                node_id = f"entity_{entity_type}_{entity}"
-                if node_id not in all_nodes:
-                    all_nodes[node_id] = {
-                        'id': node_id,
-                        'label': entity,
-                        'type': entity_type,
-                        'level': 0
-                    }
-        
+    
+    # 从预测结果中提取ICD编码
+    icd_predictions = predictions.get('icdPredictions', [])
+    entities = predictions.get('entities', {})
+    
+    if not icd_predictions:
         return {
-            "nodes": list(all_nodes.values()),
-            "edges": all_edges,
-            "paths": paths,
-            "entities": entities,
-            "metadata": graph_manager.get_latest_metadata()
+            "nodes": [],
+            "edges": [],
+            "paths": [],
+            "entities": entities
+        }
+    
+    # 重新加载数据以获取最新的层次结构
+    await asyncio.to_thread(graph_manager.reload_if_changed)
+    
+    # 获取top-3个ICD编码的图谱数据
+    top_icds = [pred for pred in icd_predictions[:3] if pred.get('code', '')]
+    icd_codes = [pred['code'] for pred in top_icds]
+    
+    # 相关节点（逐个编码取缓存结果后合并去重）与各编码的层次路径互不依赖，并发获取
+    related, *hierarchy_paths = await asyncio.gather(
+        asyncio.to_thread(graph_manager.get_related_nodes_batch, icd_codes, 2),
+        *[asyncio.to_thread(graph_manager.get_hierarchy_path, icd_code) for icd_code in icd_codes]
+    )
+    
+    all_nodes = {node['id']: node for node in related['nodes']}
+    # 与节点一样按规范键合并边，多个ICD共享祖先时不会重复输出
+    all_edges: Dict[tuple, Dict[str, Any]] = {}
+    for edge in related['edges']:
+        all_edges.setdefault(_edge_key(edge), edge)
+    paths = [
+        {
+            'icd_code': pred['code'],
+            'icd_name': pred.get('description', ''),
+            'probability': pred.get('probability', 0.0),
+            'hierarchy_path': hierarchy_path,
+            'related_nodes': related['related'].get(pred['code'], [])
         }
+        for pred, hierarchy_path in zip(top_icds, hierarchy_paths)
+    ]
+    
+    # 添加实体节点
+    for node_id, node in _entity_nodes(entities).items():
+        all_nodes.setdefault(node_id, node)
+    
+    return {
+        "nodes": list(all_nodes.values()),
+        "edges": list(all_edges.values()),
+        "paths": paths,
+        "entities": entities,
+        "metadata": graph_manager.get_latest_metadata()
+    }
+
+
+@router.post("/visualize")
+async def visualize_graph_from_predictions(
+    predictions: Optional[Dict[str, Any]] = Body(None, description="预测结果数据")
+):
+
+    try:
+        return await _build_visualization(predictions)
     
     except Exception as e:
         logger.error(f"生成图谱可视化数据失败: {str(e)}")
@@ -136,88 +157,104 @@ async def visualize_graph_from_predictions(
 async def get_visualize_graph():
     """获取最新的知识图谱可视化数据（从icd_hierarchy.json读取）"""
     try:
-        predictions = graph_manager.get_latest_predictions()
-        if not predictions:
-            return {
-                "nodes": [],
-                "edges": [],
-                "paths": [],
-                "entities": {},
-                "message": "暂无预测结果，请先运行预测"
-            }
+        return await _build_visualization(None)
+    
+    except Exception as e:
+        logger.error(f"获取图谱可视化数据失败: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"获取图谱可视化数据失败: {str(e)}")
+
+
+def _ndjson(record: Dict[str, Any]) -> bytes:
+    return json_dumps(record) + b"\n"
+
+
+async def _stream_visualization(predictions: Optional[Dict[str, Any]], error_message: str) -> AsyncIterator[bytes]:
+    """以NDJSON逐条输出知识图谱可视化数据
+    
+    每个top ICD输出一行 {"type": "path"}，只包含此前未输出过的节点和边，便于前端增量渲染；
+    随后输出 {"type": "entities"}，最后输出 {"type": "meta"}。
+    """
+    try:
+        if predictions is None:
+            predictions = await asyncio.to_thread(graph_manager.get_latest_predictions)
+            if not predictions:
+                yield _ndjson({"type": "meta", "metadata": {}, "message": "暂无预测结果，请先运行预测"})
+                return
         
-        # 使用与POST接口相同的逻辑
         icd_predictions = predictions.get('icdPredictions', [])
         entities = predictions.get('entities', {})
         
-        if not icd_predictions:
-            return {
-                "nodes": [],
-                "edges": [],
-                "paths": [],
-                "entities": entities
-            }
-        
-        # 重新加载数据以获取最新的层次结构
-        graph_manager.reload_data()
-        
-        # 获取top-3个ICD编码的图谱数据
-        top_icds = icd_predictions[:3]
-        
-        all_nodes = {}
-        all_edges = []
-        paths = []
-        
-        for pred in top_icds:
-            icd_code = pred.get('code', '')
-            if not icd_code:
-                continue
+        if icd_predictions:
+            await asyncio.to_thread(graph_manager.reload_if_changed)
+            top_icds = [pred for pred in icd_predictions[:3] if pred.get('code', '')]
             
-            # 获取ICD编码的图谱信息
-            related = graph_manager.get_related_nodes(icd_code, depth=2)
-            hierarchy_path = graph_manager.get_hierarchy_path(icd_code)
-            
-            # 合并节点
-            for node in related.get('nodes', []):
-                node_id = node.get('id', '')
-                if node_id:
-                    all_nodes[node_id] = node
-            
-            # 合并边
-            all_edges.extend(related.get('edges', []))
-            
-            # 添加路径
-            paths.append({
-                'icd_code': icd_code,
-                'icd_name': pred.get('description', ''),
-                'probability': pred.get('probability', 0.0),
-                'hierarchy_path': hierarchy_path,
-                'related_nodes': related.get('nodes', [])
-            })
-        
-        # 添加实体节点
-        for entity_type, entity_list in entities.items():
-            for entity in entity_list[:5]:  # 每个类型最多5个实体
-                node_id = f"entity_{entity_type}_{entity}"
-                if node_id not in all_nodes:
-                    all_nodes[node_id] = {
-                        'id': node_id,
-                        'label': entity,
-                        'type': entity_type,
-                        'level': 0
-                    }
+            # 各编码的子图与层次路径同时开始计算，按预测顺序逐条输出
+            pending = [
+                asyncio.gather(
+                    asyncio.to_thread(graph_manager.get_related_nodes, pred['code'], 2),
+                    asyncio.to_thread(graph_manager.get_hierarchy_path, pred['code'])
+                )
+                for pred in top_icds
+            ]
+            seen_nodes = set()
+            seen_edges = set()
+            for pred, future in zip(top_icds, pending):
+                related, hierarchy_path = await future
+                nodes = []
+                for node in related['nodes']:
+                    if node['id'] not in seen_nodes:
+                        seen_nodes.add(node['id'])
+                        nodes.append(node)
+                edges = []
+                for edge in related['edges']:
+                    key = _edge_key(edge)
+                    if key not in seen_edges:
+                        seen_edges.add(key)
+                        edges.append(edge)
+                yield _ndjson({
+                    "type": "path",
+                    "path": {
+                        'icd_code': pred['code'],
+                        'icd_name': pred.get('description', ''),
+                        'probability': pred.get('probability', 0.0),
+                        'hierarchy_path': hierarchy_path,
+                        'related_nodes': related['nodes']
+                    },
+                    "nodes": nodes,
+                    "edges": edges
+                })
         
-        return {
-            "nodes": list(all_nodes.values()),
-            "edges": all_edges,
-            "paths": paths,
+        yield _ndjson({
+            "type": "entities",
             "entities": entities,
-            "metadata": graph_manager.get_latest_metadata()
-        }
+            "nodes": list(_entity_nodes(entities).values())
+        })
+        yield _ndjson({"type": "meta", "metadata": graph_manager.get_latest_metadata()})
     
     except Exception as e:
-        logger.error(f"获取图谱可视化数据失败: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"获取图谱可视化数据失败: {str(e)}")
+        # 响应头已发送，无法再返回500，改为输出错误记录
+        logger.error(f"{error_message}: {str(e)}")
+        yield _ndjson({"type": "error", "detail": f"{error_message}: {str(e)}"})
+
+
+@router.post("/visualize/stream")
+async def stream_graph_from_predictions(
+    predictions: Optional[Dict[str, Any]] = Body(None, description="预测结果数据")
+):
+    """流式生成知识图谱可视化数据（NDJSON）"""
+    return StreamingResponse(
+        _stream_visualization(predictions, "生成图谱可视化数据失败"),
+        media_type="application/x-ndjson"
+    )
+
+
+@router.get("/visualize/stream")
+async def stream_visualize_graph():
+    """流式获取最新的知识图谱可视化数据（NDJSON）"""
+    return StreamingResponse(
+        _stream_visualization(None, "获取图谱可视化数据失败"),
+        media_type="application/x-ndjson"
+    )
 
 
 @router.get("/explain")
@@ -229,7 +266,7 @@ async def explain_graph_path(
     返回ICD编码的层次路径和相关知识，用于解释预测结果
     """
     try:
-        result = graph_manager.explain_icd_path(icd)
+        result = await asyncio.to_thread(graph_manager.explain_icd_path, icd)
         
         if not result.get('exists'):
             raise HTTPException(status_code=404, detail=result.get('message', 'ICD编码未找到'))
@@ -243,13 +280,13 @@ async def explain_graph_path(
         raise HTTPException(status_code=500, detail=f"知识路径解释失败: {str(e)}")
 
 
-@router.get("/hierarchy")
+@router.get("/hierarchy", dependencies=[Depends(graph_etag)])
 async def get_hierarchy_path(
     icd: str = Query(..., description="ICD编码")
 ):
     """获取ICD编码的层次路径"""
     try:
-        path = graph_manager.get_hierarchy_path(icd)
+        path = await asyncio.to_thread(graph_manager.get_hierarchy_path, icd)
         
         if not path:
             raise HTTPException(status_code=404, detail=f"ICD编码 {icd} 未找到")
@@ -267,27 +304,14 @@ async def get_hierarchy_path(
         raise HTTPException(status_code=500, detail=f"获取层次路径失败: {str(e)}")
 
 
-@router.get("/search")
+@router.get("/search", dependencies=[Depends(graph_etag)])
 async def search_icd(
     query: str = Query(..., description="搜索关键词"),
     limit: int = Query(10, description="返回结果数量限制")
 ):
     """搜索ICD编码"""
     try:
-        results = []
-        query_lower = query.lower()
-        
-        # 在ICD层次结构中搜索
-        for code, info in graph_manager.icd_hierarchy.items():
-            name = info.get('name', '').lower()
-            if query_lower in code or query_lower in name:
-                results.append({
-                    'code': code,
-                    'name': info.get('name', ''),
-                    'level': info.get('level', 0)
-                })
-                if len(results) >= limit:
-                    break
+        results = await asyncio.to_thread(graph_manager.search_icd, query, limit)
         
         return {
             "query": query,
@@ -312,7 +336,8 @@ async def semantic_similarity_search(
     根据医学概念查找相似的ICD编码
     """
     try:
-        results = graph_manager.search_semantic_similarity(
+        results = await asyncio.to_thread(
+            graph_manager.search_semantic_similarity,
             concept=concept,
             threshold=threshold,
             max_results=max_results
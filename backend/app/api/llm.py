@@ -1,13 +1,28 @@
 """LLM API路由"""
-from fastapi import APIRouter, HTTPException, Body
+import time
+from functools import lru_cache
+from fastapi import APIRouter, HTTPException, Body, Depends
 from typing import Optional, Dict, Any
 from pydantic import BaseModel, Field
 
 from app.services.llm_intergration import llm_integration
+from app.services.batching import AsyncBatcher
 from app.core.logger import logger
+from app.core.validation import json_body, json_body_openapi
 
 router = APIRouter()
 
+# 合并并发的LLM请求
+# 按病例文本长度分桶，短请求不必等待长请求
+verify_batcher = AsyncBatcher(
+    llm_integration.verify_batch, max_batch_size=16, max_wait_ms=10,
+    length_fn=lambda item: len(item['case_text'])
+)
+explain_batcher = AsyncBatcher(
+    llm_integration.explain_batch, max_batch_size=16, max_wait_ms=10,
+    length_fn=lambda item: len(item['case_text'])
+)
+
 
 class VerifyRequest(BaseModel):
     """验证请求模型"""
@@ -23,18 +38,18 @@ class ExplainLLMRequest(BaseModel):
     icd_name: Optional[str] = Field(None, description="ICD编码名称")
 
 
-@router.post("/verify", response_model=Dict[str, Any])
-async def verify_prediction(request: VerifyRequest):
+@router.post("/verify", response_model=Dict[str, Any], openapi_extra=json_body_openapi(VerifyRequest))
+async def verify_prediction(request: VerifyRequest = Depends(json_body(VerifyRequest))):
     """验证小模型输出的语义合理性
     
     使用大模型验证预测的ICD编码与病例描述的匹配度
     """
     try:
-        result = llm_integration.verify(
-            case_text=request.case_text,
-            icd_code=request.icd_code,
-            probability=request.probability or 0.0
-        )
+        result = await verify_batcher.submit({
+            'case_text': request.case_text,
+            'icd_code': request.icd_code,
+            'probability': request.probability or 0.0
+        })
         
         return {
             "success": True,
@@ -47,18 +62,18 @@ async def verify_prediction(request: VerifyRequest):
         raise HTTPException(status_code=500, detail=f"LLM验证失败: {str(e)}")
 
 
-@router.post("/explain", response_model=Dict[str, Any])
-async def explain_with_llm(request: ExplainLLMRequest):
+@router.post("/explain", response_model=Dict[str, Any], openapi_extra=json_body_openapi(ExplainLLMRequest))
+async def explain_with_llm(request: ExplainLLMRequest = Depends(json_body(ExplainLLMRequest))):
     """生成可读的医学解释文本
     
     使用大模型生成自然语言解释，说明为什么病例会被编码为该ICD编码
     """
     try:
-        result = llm_integration.explain(
-            case_text=request.case_text,
-            icd_code=request.icd_code,
-            icd_name=request.icd_name
-        )
+        result = await explain_batcher.submit({
+            'case_text': request.case_text,
+            'icd_code': request.icd_code,
+            'icd_name': request.icd_name
+        })
         
         return {
             "success": True,
@@ -71,17 +86,23 @@ async def explain_with_llm(request: ExplainLLMRequest):
         raise HTTPException(status_code=500, detail=f"LLM解释生成失败: {str(e)}")
 
 
+@lru_cache(maxsize=8)
+def _cached_health(bucket: int) -> Dict[str, Any]:
+    """按秒分桶缓存健康检查结果"""
+    # 简单的健康检查
+    return {
+        "status": "available",
+        "provider": llm_integration.provider,
+        "model": llm_integration.model,
+        "api_key_configured": bool(llm_integration.api_key)
+    }
+
+
 @router.get("/health")
 async def llm_health_check():
     """LLM服务健康检查"""
     try:
-        # 简单的健康检查
-        return {
-            "status": "available",
-            "provider": llm_integration.provider,
-            "model": llm_integration.model,
-            "api_key_configured": bool(llm_integration.api_key)
-        }
+        return _cached_health(int(time.time()))
     
     except Exception as e:
         logger.error(f"LLM健康检查失败: {str(e)}")
@@ -1,10 +1,15 @@
 """模型管理API路由（简化版，仅用于测试）"""
-from fastapi import APIRouter, HTTPException
+import time
+from functools import lru_cache
+from fastapi import APIRouter, HTTPException, Depends, Query
+from fastapi.responses import ORJSONResponse
 from typing import List, Dict, Any, Optional
 from pydantic import BaseModel, Field
 
 from app.services.model_manager import model_manager
+from app.data.model_repository import get_model_repository
 from app.core.logger import logger
+from app.core.validation import json_body, json_body_openapi
 
 router = APIRouter()
 
@@ -29,38 +34,46 @@ class SwitchModelRequest(BaseModel):
     model_name: str = Field(..., description="要切换到的模型名称")
 
 
+@lru_cache(maxsize=8)
+def _cached_model_list(bucket: int) -> ModelListResponse:
+    """按秒分桶缓存模型列表，同一秒内的轮询共享一次结果"""
+    available_models = model_manager.get_available_models()
+    current_model = model_manager.current_model
+    
+    models_info = []
+    for model_name in available_models:
+        models_info.append(ModelInfo(
+            name=model_name,
+            available=True,
+            current=(model_name == current_model),
+            type="small_model"
+        ))
+    
+    return ModelListResponse(
+        models=models_info,
+        current_model=current_model,
+        total=len(models_info)
+    )
+
+
 @router.get("/", response_model=ModelListResponse)
 async def list_models():
     """获取模型列表与状态"""
     try:
-        available_models = model_manager.get_available_models()
-        current_model = model_manager.current_model
-        
-        models_info = []
-        for model_name in available_models:
-            models_info.append(ModelInfo(
-                name=model_name,
-                available=True,
-                current=(model_name == current_model),
-                type="small_model"
-            ))
-        
-        return ModelListResponse(
-            models=models_info,
-            current_model=current_model,
-            total=len(models_info)
-        )
+        return _cached_model_list(int(time.time()))
     
     except Exception as e:
         logger.error(f"获取模型列表失败: {str(e)}")
         raise HTTPException(status_code=500, detail=f"获取模型列表失败: {str(e)}")
 
 
-@router.post("/switch")
-async def switch_model(request: SwitchModelRequest):
+@router.post("/switch", openapi_extra=json_body_openapi(SwitchModelRequest))
+async def switch_model(request: SwitchModelRequest = Depends(json_body(SwitchModelRequest))):
     """切换当前使用的模型"""
     try:
         success = model_manager.set_current_model(request.model_name)
+        # 当前模型已变化，丢弃缓存的模型列表
+        _cached_model_list.cache_clear()
         
         if not success:
             raise HTTPException(
@@ -81,6 +94,24 @@ async def switch_model(request: SwitchModelRequest):
         raise HTTPException(status_code=500, detail=f"切换模型失败: {str(e)}")
 
 
+@router.get("/registry/{model_type}")
+async def list_registered_models(
+    model_type: str,
+    detail: bool = Query(False, description="返回完整记录（含元数据）")
+):
+    """列出模型仓库中已注册的模型（model_type: small 或 llm）"""
+    repository = get_model_repository()
+    if model_type == "small":
+        models = repository.list_small_models(detail)
+    elif model_type == "llm":
+        models = repository.list_llm_models(detail)
+    else:
+        raise HTTPException(status_code=400, detail=f"未知的模型类型: {model_type}")
+    
+    # 元数据常驻内存，列表已完整构建，直接一次编码返回
+    return ORJSONResponse(models)
+
+
 @router.get("/{model_name}")
 async def get_model_info(model_name: str):
     """获取特定模型的详细信息"""
@@ -1,140 +1,193 @@
 """性能指标API路由"""
-from fastapi import APIRouter, HTTPException
-from typing import List, Dict, Any, Optional
+from itertools import combinations
+from fastapi import APIRouter, HTTPException, Depends
+from fastapi.responses import ORJSONResponse
+from typing import List, Dict, Any, Optional, FrozenSet, Tuple
 from app.core.logger import logger
+from app.core.http_cache import etag_for
+from app.data.graph_database import GraphDatabase, get_graph_database
 
 router = APIRouter()
 
+# 性能指标为静态数据，ETag只取决于请求参数
+static_etag = etag_for()
 
-@router.get("/metrics")
+# 模拟性能指标数据（实际应从数据库或评估结果中获取），静态数据在导入时构建一次
+_METRICS = {
+    "models": [
+        {
+            "name": "CAML",
+            "micro_f1": 0.82,
+            "macro_f1": 0.78,
+            "top_k_precision": {
+                "top_1": 0.85,
+                "top_3": 0.92,
+                "top_5": 0.95,
+                "top_10": 0.98
+            },
+            "average_precision": 0.87
+        },
+        {
+            "name": "DCAN",
+            "micro_f1": 0.84,
+            "macro_f1": 0.80,
+            "top_k_precision": {
+                "top_1": 0.87,
+                "top_3": 0.93,
+                "top_5": 0.96,
+                "top_10": 0.99
+            },
+            "average_precision": 0.89
+        },
+        {
+            "name": "Fusion",
+            "micro_f1": 0.86,
+            "macro_f1": 0.82,
+            "top_k_precision": {
+                "top_1": 0.89,
+                "top_3": 0.94,
+                "top_5": 0.97,
+                "top_10": 0.99
+            },
+            "average_precision": 0.91
+        },
+        {
+            "name": "TransICD",
+            "micro_f1": 0.85,
+            "macro_f1": 0.81,
+            "top_k_precision": {
+                "top_1": 0.88,
+                "top_3": 0.94,
+                "top_5": 0.96,
+                "top_10": 0.99
+            },
+            "average_precision": 0.90
+        }
+    ],
+    "overall": {
+        "average_micro_f1": 0.84,
+        "average_macro_f1": 0.80,
+        "average_top_1_precision": 0.87,
+        "average_top_3_precision": 0.93
+    }
+}
+
+
+# Top-k折线图各模型的固定颜色（hash()带随机盐，跨进程不稳定会导致响应不可缓存）
+_MODEL_COLORS = {
+    "CAML": "rgba(59, 130, 246, 1)",
+    "DCAN": "rgba(16, 185, 129, 1)",
+    "Fusion": "rgba(245, 158, 11, 1)",
+    "TransICD": "rgba(239, 68, 68, 1)"
+}
+_FALLBACK_COLORS = [
+    "rgba(99, 102, 241, 1)",
+    "rgba(168, 85, 247, 1)",
+    "rgba(236, 72, 153, 1)",
+    "rgba(20, 184, 166, 1)"
+]
+
+
+@router.get("/metrics", response_class=ORJSONResponse, dependencies=[Depends(static_etag)])
 async def get_performance_metrics():
     """获取模型性能指标
     
     返回Micro-F1、Top-k Precision等指标（模拟数据，实际应从数据库或评估结果中获取）
     """
-    try:
-        # 模拟性能指标数据（实际应从数据库或评估结果中获取）
-        metrics = {
-            "models": [
-                {
-                    "name": "CAML",
-                    "micro_f1": 0.82,
-                    "macro_f1": 0.78,
-                    "top_k_precision": {
-                        "top_1": 0.85,
-                        "top_3": 0.92,
-                        "top_5": 0.95,
-                        "top_10": 0.98
-                    },
-                    "average_precision": 0.87
-                },
-                {
-                    "name": "DCAN",
-                    "micro_f1": 0.84,
-                    "macro_f1": 0.80,
-                    "top_k_precision": {
-                        "top_1": 0.87,
-                        "top_3": 0.93,
-                        "top_5": 0.96,
-                        "top_10": 0.99
-                    },
-                    "average_precision": 0.89
-                },
-                {
-                    "name": "Fusion",
-                    "micro_f1": 0.86,
-                    "macro_f1": 0.82,
-                    "top_k_precision": {
-                        "top_1": 0.89,
-                        "top_3": 0.94,
-                        "top_5": 0.97,
-                        "top_10": 0.99
-                    },
-                    "average_precision": 0.91
-                },
-                {
-                    "name": "TransICD",
-                    "micro_f1": 0.85,
-                    "macro_f1": 0.81,
-                    "top_k_precision": {
-                        "top_1": 0.88,
-                        "top_3": 0.94,
-                        "top_5": 0.96,
-                        "top_10": 0.99
-                    },
-                    "average_precision": 0.90
-                }
-            ],
-            "overall": {
-                "average_micro_f1": 0.84,
-                "average_macro_f1": 0.80,
-                "average_top_1_precision": 0.87,
-                "average_top_3_precision": 0.93
-            }
-        }
-        
-        return metrics
+    return _METRICS
+
+
+def _build_chart_data(metric_type: Optional[str], model_names: Optional[FrozenSet[str]]) -> Dict[str, Any]:
+    """构建图表数据（model_names为None表示全部模型）"""
+    all_models = _METRICS["models"]
     
-    except Exception as e:
-        logger.error(f"获取性能指标失败: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"获取性能指标失败: {str(e)}")
+    # 过滤模型
+    if model_names is not None:
+        filtered_models = [m for m in all_models if m["name"] in model_names]
+    else:
+        filtered_models = all_models
+    
+    # 根据指标类型构建图表数据
+    chart_data = {
+        "labels": [m["name"] for m in filtered_models],
+        "datasets": []
+    }
+    
+    if metric_type == "micro_f1":
+        chart_data["datasets"].append({
+            "label": "Micro-F1",
+            "data": [m["micro_f1"] for m in filtered_models],
+            "backgroundColor": "rgba(99, 102, 241, 0.5)",
+            "borderColor": "rgba(99, 102, 241, 1)",
+            "borderWidth": 2
+        })
+    elif metric_type == "macro_f1":
+        chart_data["datasets"].append({
+            "label": "Macro-F1",
+            "data": [m["macro_f1"] for m in filtered_models],
+            "backgroundColor": "rgba(168, 85, 247, 0.5)",
+            "borderColor": "rgba(168, 85, 247, 1)",
+            "borderWidth": 2
+        })
+    elif metric_type == "top_k_precision":
+        # Top-k Precision 折线图
+        top_ks = ["top_1", "top_3", "top_5", "top_10"]
+        for i, model in enumerate(filtered_models):
+            chart_data["datasets"].append({
+                "label": model["name"],
+                "data": [model["top_k_precision"][k] for k in top_ks],
+                "borderColor": _MODEL_COLORS.get(
+                    model["name"], _FALLBACK_COLORS[i % len(_FALLBACK_COLORS)]
+                ),
+                "borderWidth": 2,
+                "fill": False
+            })
+        chart_data["labels"] = ["Top-1", "Top-3", "Top-5", "Top-10"]
+    
+    return chart_data
+
 
+# 指标静态不变，导入时预先构建所有指标类型与模型子集组合的图表数据
+_MODEL_NAMES = frozenset(m["name"] for m in _METRICS["models"])
+_CHART_DATA_CACHE: Dict[Tuple[str, FrozenSet[str]], Dict[str, Any]] = {
+    (metric_type, frozenset(subset)): _build_chart_data(metric_type, frozenset(subset))
+    for metric_type in ("micro_f1", "macro_f1", "top_k_precision")
+    for size in range(len(_MODEL_NAMES) + 1)
+    for subset in combinations(sorted(_MODEL_NAMES), size)
+}
 
-@router.get("/chart-data")
+
+@router.get("/chart-data", response_class=ORJSONResponse, dependencies=[Depends(static_etag)])
 async def get_chart_data(
     metric_type: Optional[str] = "micro_f1",
     models: Optional[str] = None
 ):
     try:
-        # 获取性能指标
-        metrics_response = await get_performance_metrics()
-        all_models = metrics_response.get("models", [])
-        
-        # 过滤模型
+        # 只有已知模型影响过滤结果，请求的模型集合与已知模型取交集作为缓存键
         if models:
-            model_names = [m.strip() for m in models.split(",")]
-            filtered_models = [m for m in all_models if m["name"] in model_names]
+            model_names = frozenset(m.strip() for m in models.split(",")) & _MODEL_NAMES
         else:
-            filtered_models = all_models
-        
-        # 根据指标类型构建图表数据
-        chart_data = {
-            "labels": [m["name"] for m in filtered_models],
-            "datasets": []
-        }
-        
-        if metric_type == "micro_f1":
-            chart_data["datasets"].append({
-                "label": "Micro-F1",
-                "data": [m["micro_f1"] for m in filtered_models],
-                "backgroundColor": "rgba(99, 102, 241, 0.5)",
-                "borderColor": "rgba(99, 102, 241, 1)",
-                "borderWidth": 2
-            })
-        elif metric_type == "macro_f1":
-            chart_data["datasets"].append({
-                "label": "Macro-F1",
-                "data": [m["macro_f1"] for m in filtered_models],
-                "backgroundColor": "rgba(168, 85, 247, 0.5)",
-                "borderColor": "rgba(168, 85, 247, 1)",
-                "borderWidth": 2
-            })
-        elif metric_type == "top_k_precision":
-            # Top-k Precision 折线图
-            top_ks = ["top_1", "top_3", "top_5", "top_10"]
-            for model in filtered_models:
-                chart_data["datasets"].append({
-                    "label": model["name"],
-                    "data": [model["top_k_precision"][k] for k in top_ks],
-                    "borderColor": f"rgba({hash(model['name']) % 255}, {(hash(model['name']) * 2) % 255}, {(hash(model['name']) * 3) % 255}, 1)",
-                    "borderWidth": 2,
-                    "fill": False
-                })
-            chart_data["labels"] = ["Top-1", "Top-3", "Top-5", "Top-10"]
+            model_names = _MODEL_NAMES
         
-        return chart_data
+        cached = _CHART_DATA_CACHE.get((metric_type, model_names))
+        if cached is not None:
+            return cached
+        # 未预计算的指标类型
+        return _build_chart_data(metric_type, model_names)
     
     except Exception as e:
         logger.error(f"获取图表数据失败: {str(e)}")
         raise HTTPException(status_code=500, detail=f"获取图表数据失败: {str(e)}")
 
+
+@router.get("/cache/stats", response_class=ORJSONResponse)
+async def get_cache_stats(graph_database: GraphDatabase = Depends(get_graph_database)):
+    """获取图数据库查询结果缓存的命中统计"""
+    return {"graph_database": graph_database.cache_stats()}
+
+
+@router.post("/cache/clear", response_class=ORJSONResponse)
+async def clear_cache(graph_database: GraphDatabase = Depends(get_graph_database)):
+    """清空图数据库查询结果缓存"""
+    graph_database.clear_cache()
+    return {"success": True}
@@ -1,16 +1,49 @@
 """预测API路由"""
-from fastapi import APIRouter, HTTPException
-from typing import Optional, List, Dict, Any
+from fastapi import APIRouter, HTTPException, Depends, Query, Request
+from fastapi.responses import ORJSONResponse, Response
+from typing import Annotated, Optional, List, Dict, Any
 from pydantic import BaseModel, Field
+import asyncio
 import time
-import json
+import random
+import threading
 from pathlib import Path
 from datetime import datetime
 
 from app.core.logger import logger
+from app.tests.mock_predict import mock_predictor
 from app.core.config import settings
+from app.core.utils import json_dumps, save_json_stream, icd_code_prefixes
+from app.core.validation import json_body, json_body_openapi
 
-router = APIRouter()
+# 预测结果体积较大，默认使用orjson编码响应
+router = APIRouter(default_response_class=ORJSONResponse)
+
+# 模拟预测响应中与输入无关的字段，导入时预先编码为JSON片段，请求时只编码其余字段再拼接
+_CONSTANT_FIELDS: Dict[str, Any] = {
+    'entities': mock_predictor.MOCK_ENTITIES,
+    'entityCount': mock_predictor._ENTITY_COUNT,
+    'keywordHeatmap': mock_predictor._KEYWORD_HEATMAP_TOP,
+    'featureImportance': mock_predictor._FEATURE_IMPORTANCE_TOP,
+    'decisionPath': mock_predictor.MOCK_DECISION_PATH,
+    'isMock': True,
+    'mockMode': True
+}
+_CONSTANT_FRAGMENT = json_dumps(_CONSTANT_FIELDS)[1:-1]
+
+
+def _encode_prediction(result: Dict[str, Any]) -> bytes:
+    """编码预测结果；常量字段仍是原对象时复用预编码片段，否则完整编码"""
+    if any(result.get(key) is not value for key, value in _CONSTANT_FIELDS.items()):
+        return json_dumps(result)
+    variable = json_dumps({key: value for key, value in result.items() if key not in _CONSTANT_FIELDS})
+    if variable == b'{}':
+        return b'{' + _CONSTANT_FRAGMENT + b'}'
+    return b'{' + _CONSTANT_FRAGMENT + b',' + variable[1:]
+
+
+# 保存在线程池中执行，串行化并发请求对同一文件的写入
+_save_lock = threading.Lock()
 
 
 class PredictRequest(BaseModel):
@@ -25,11 +58,23 @@ class PredictRequest(BaseModel):
         populate_by_name = True
 
 
+class PredictBatchRequest(BaseModel):
+    """批量预测请求模型"""
+    # 限制病例数和单个文本长度，单个请求不会长时间占用worker
+    caseTexts: List[Annotated[str, Field(max_length=settings.PREDICT_BATCH_MAX_TEXT_LENGTH)]] = Field(
+        ..., description="病例文本列表", alias="caseTexts", max_length=settings.PREDICT_BATCH_MAX_SIZE
+    )
+    model: Optional[str] = Field(None, description="指定使用的模型")
+    params: Optional[Dict[str, Any]] = Field(None, description="模型参数")
+    
+    class Config:
+        populate_by_name = True
+
+
 def save_prediction_to_hierarchy(result: Dict[str, Any], original_text: str, model_name: str, top_k: int, threshold: float) -> bool:
     """保存预测结果到icd_hierarchy.json"""
     try:
         icd_hierarchy_path = Path(settings.ICD_HIERARCHY_PATH)
-        icd_hierarchy_path.parent.mkdir(parents=True, exist_ok=True)
         
         # 构建要保存的数据结构
         prediction_data = {
@@ -38,115 +83,176 @@ def save_prediction_to_hierarchy(result: Dict[str, Any], original_text: str, mod
             'model': model_name,
             'top_k': top_k,
             'threshold': threshold,
-            'predictions': result,
-            'icd_hierarchy': {}
+            'predictions': result
         }
         
         # 从预测结果中提取ICD编码，构建层次结构
-        # 首先构建一个代码到描述的映射，用于填充父节点名称
+        # 先一次遍历构建编码到描述、编码到概率的映射，用于填充父节点
+        # 预测结果已在 _run_prediction 中按概率降序排列，每个编码首次出现即为其最大概率
+        predictions = result.get('icdPredictions', [])
         code_to_description = {}
-        for pred in result.get('icdPredictions', []):
+        code_to_probability = {}
+        for pred in predictions:
             code = pred.get('code', '')
             description = pred.get('description', '')
             if code and description:
                 code_to_description[code] = description
+            code_to_probability.setdefault(code, pred.get('probability', 0.0))
         
         icd_hierarchy = {}
-        for pred in result.get('icdPredictions', []):
+        # 子节点去重用的集合与输出节点分开存放，避免在children列表上做线性查找
+        child_sets: Dict[str, set] = {}
+        for pred in predictions:
             code = pred.get('code', '')
             description = pred.get('description', '')
             probability = pred.get('probability', 0.0)
             
             if code:
-                # 解析ICD编码层次（例如：410.71 -> 410, 410.7, 410.71）
-                parts = code.split('.')
-                current_code = ''
+                # 解析ICD编码层次（例如：410.71 -> 410, 410.7, 410.71），父编码即上一层的编码
+                parent_code = None
                 
-                for i, part in enumerate(parts):
-                    if i == 0:
-                        current_code = part
-                    else:
-                        current_code = f"{current_code}.{part}"
-                    
+                for i, current_code in enumerate(icd_code_prefixes(code)):
                     if current_code not in icd_hierarchy:
                         # 优先使用当前预测结果的描述，如果没有则从映射中查找
-                        node_name = description if current_code == code else code_to_description.get(current_code, '')
-                        node_probability = probability if current_code == code else max(
-                            (p.get('probability', 0.0) for p in result.get('icdPredictions', []) 
-                             if p.get('code', '') == current_code),
-                            default=0.0
-                        )
+                        if current_code == code:
+                            node_name = description
+                            node_probability = probability
+                        else:
+                            node_name = code_to_description.get(current_code, '')
+                            node_probability = code_to_probability.get(current_code, 0.0)
                         
                         icd_hierarchy[current_code] = {
                             'code': current_code,
                             'name': node_name,
                             'level': i + 1,
-                            'parent': '.'.join(parts[:i]) if i > 0 else None,
+                            'parent': parent_code,
                             'children': [],
                             'probability': node_probability
                         }
                     
                     # 添加父子关系
-                    if i > 0:
-                        parent_code = '.'.join(parts[:i])
-                        if parent_code in icd_hierarchy:
-                            if current_code not in icd_hierarchy[parent_code]['children']:
-                                icd_hierarchy[parent_code]['children'].append(current_code)
+                    if parent_code is not None and parent_code in icd_hierarchy:
+                        seen_children = child_sets.setdefault(parent_code, set())
+                        if current_code not in seen_children:
+                            seen_children.add(current_code)
+                            icd_hierarchy[parent_code]['children'].append(current_code)
+                    parent_code = current_code
         
-        prediction_data['icd_hierarchy'] = icd_hierarchy
+        # 保存到文件（层次结构节点逐个编码写入；文件供程序读取，使用紧凑格式）
+        with _save_lock:
+            save_json_stream(
+                prediction_data, 'icd_hierarchy', icd_hierarchy.items(), str(icd_hierarchy_path)
+            )
         
-        # 保存到文件
-        with open(icd_hierarchy_path, 'w', encoding='utf-8') as f:
-            json.dump(prediction_data, f, ensure_ascii=False, indent=2)
-        
-        logger.info(f"预测结果已保存到 {icd_hierarchy_path}")
+        logger.info("预测结果已保存到 %s", icd_hierarchy_path)
         return True
         
     except Exception as e:
-        logger.error(f"保存预测结果失败: {str(e)}")
+        logger.error("保存预测结果失败: %s", e)
         return False
 
 
-@router.post("", include_in_schema=True)
-@router.post("/")
-async def predict(request: PredictRequest):
+async def _run_prediction(
+    case_text: str,
+    model_name: str,
+    top_k: int,
+    threshold: float
+) -> Dict[str, Any]:
+    """执行预测并保存结果（JSON与流式上传接口共用）"""
+    logger.info("使用测试预测模式")
+    
+    result = mock_predictor.predict(
+        case_text, 
+        model=model_name, 
+        top_k=top_k, 
+        threshold=threshold
+    )
+    
+    # 按概率降序排序一次，层次结构构建与响应共用同一顺序
+    predictions = sorted(result.get('icdPredictions', []), key=lambda p: p.get('probability', 0.0), reverse=True)
+    result['icdPredictions'] = predictions[:top_k]
+    
+    # 保存预测结果到icd_hierarchy.json（在线程池中执行，失败时只记录日志）
+    # 前端随后请求的 /graph/visualize、/graph/query 读取该文件，须在返回响应前写完
+    await asyncio.to_thread(
+        save_prediction_to_hierarchy,
+        result, 
+        case_text, 
+        model_name, 
+        top_k, 
+        threshold
+    )
+    
+    logger.info("测试预测完成，返回 %d 个ICD预测结果", len(result.get('icdPredictions', [])))
+    return result
+
+
+@router.post("", include_in_schema=True, openapi_extra=json_body_openapi(PredictRequest))
+@router.post("/", openapi_extra=json_body_openapi(PredictRequest))
+async def predict(request: PredictRequest = Depends(json_body(PredictRequest))):
     """实时推理接口（使用测试数据）"""
     start_time = time.time()
     
     try:
-        from app.tests.mock_predict import mock_predictor
-        logger.info("使用测试预测模式")
-        
         top_k = request.params.get('topK', 10) if request.params else 10
         threshold = request.params.get('threshold', 0.5) if request.params else 0.5
         model_name = request.model or 'CAML'
         
-        result = mock_predictor.predict(
-            request.caseText, 
-            model=model_name, 
-            top_k=top_k, 
-            threshold=threshold
-        )
-        
-        # 保存预测结果到icd_hierarchy.json
-        save_success = save_prediction_to_hierarchy(
-            result, 
-            request.caseText, 
-            model_name, 
-            top_k, 
-            threshold
-        )
-        
-        if save_success:
-            logger.info("预测结果已保存到icd_hierarchy.json")
-        else:
-            logger.warning("预测结果保存失败，但继续返回预测结果")
+        result = await _run_prediction(request.caseText, model_name, top_k, threshold)
+        return Response(content=_encode_prediction(result), media_type="application/json")
+    
+    except Exception as e:
+        logger.error("测试结果输出失败: %s", e)
+        raise HTTPException(status_code=500, detail=f"测试结果输出失败: {str(e)}")
+
+
+@router.post("/batch", openapi_extra=json_body_openapi(PredictBatchRequest))
+async def predict_batch(request: PredictBatchRequest = Depends(json_body(PredictBatchRequest))):
+    """批量推理接口（使用测试数据）
+    
+    一次请求提交多个病例，整批在一次调用中完成预测；批量结果不写入 icd_hierarchy.json
+    """
+    try:
+        top_k = request.params.get('topK', 10) if request.params else 10
+        threshold = request.params.get('threshold', 0.5) if request.params else 0.5
+        model_name = request.model or 'CAML'
         
-        logger.info(f"测试预测完成，返回 {len(result.get('icdPredictions', []))} 个ICD预测结果")
-        return result
+        results = mock_predictor.predict_batch(request.caseTexts, model=model_name, top_k=top_k, threshold=threshold)
+        content = b'{"results":[' + b','.join(_encode_prediction(result) for result in results) + b'],"total":' + str(len(results)).encode() + b'}'
+        return Response(content=content, media_type="application/json")
+    
+    except Exception as e:
+        logger.error("批量测试结果输出失败: %s", e)
+        raise HTTPException(status_code=500, detail=f"批量测试结果输出失败: {str(e)}")
+
+
+@router.post(
+    "/text",
+    openapi_extra={"requestBody": {"required": True, "content": {"text/plain": {"schema": {"type": "string"}}}}}
+)
+async def predict_text(
+    request: Request,
+    model: Optional[str] = Query(None, description="指定使用的模型"),
+    topK: int = Query(10, description="返回top-k个ICD编码"),
+    threshold: float = Query(0.5, description="预测概率阈值")
+):
+    """实时推理接口（病例文本作为text/plain请求体上传，参数放在查询字符串中）
+    
+    适用于长病历：文本不必嵌入JSON，省去整段文本的JSON转义与解析。
+    请求体读取完整后再解码预测，并非增量处理。
+    """
+    body = await request.body()
+    try:
+        case_text = body.decode('utf-8')
+    except UnicodeDecodeError:
+        raise HTTPException(status_code=400, detail="病例文本必须为UTF-8编码")
+    
+    try:
+        result = await _run_prediction(case_text, model or 'CAML', topK, threshold)
+        return Response(content=_encode_prediction(result), media_type="application/json")
     
     except Exception as e:
-        logger.error(f"测试结果输出失败: {str(e)}")
+        logger.error("测试结果输出失败: %s", e)
         raise HTTPException(status_code=500, detail=f"测试结果输出失败: {str(e)}")
 
 
@@ -160,34 +266,37 @@ async def health_check():
     }
 
 
+# 样例病例为静态数据，导入时预先编码每种推荐结果对应的完整响应，请求时只需随机选择
+_SAMPLE_CASES = [
+    {
+        "title": "急性心肌梗死",
+        "text": "患者，男性，65岁，因突发胸痛3小时入院。患者诉胸闷、胸痛，疼痛呈压榨样，向左肩及左臂放射，伴大汗、恶心。既往有高血压病史10年。查体：BP 140/90mmHg，心率90次/分，律齐，心音低钝，双肺未闻及干湿啰音。心电图示：V1-V4导联ST段弓背向上抬高。肌钙蛋白I升高。诊断为急性前壁心肌梗死。"
+    },
+    {
+        "title": "心力衰竭",
+        "text": "患者，女性，72岁，因活动后气促、双下肢水肿1个月入院。患者既往有冠心病、高血压病史20年。查体：BP 150/95mmHg，心率100次/分，房颤心律，双肺底可闻及湿啰音，心脏扩大，心尖区可闻及奔马律，双下肢中度凹陷性水肿。胸部X线示：心影增大，肺淤血。超声心动图示：左心室扩大，射血分数35%。诊断为慢性心力衰竭。"
+    },
+    {
+        "title": "肺炎",
+        "text": "患者，男性，45岁，因发热、咳嗽、咳痰5天入院。患者诉发热，体温最高39℃，伴咳嗽、咳黄痰，量多，无胸痛、咯血。查体：T 38.5℃，P 95次/分，R 22次/分，BP 120/80mmHg，右肺下叶可闻及湿啰音。血常规：WBC 12.5×10^9/L，N 85%。胸部CT示：右肺下叶实变影。诊断为社区获得性肺炎。"
+    },
+    {
+        "title": "糖尿病",
+        "text": "患者，女性，58岁，因多饮、多尿、多食、体重下降2个月就诊。既往无特殊病史。查体：BP 130/80mmHg，心率80次/分，双下肢无水肿。随机血糖：15.6mmol/L，HbA1c：9.2%。诊断为2型糖尿病。"
+    },
+    {
+        "title": "慢性阻塞性肺疾病",
+        "text": "患者，男性，68岁，吸烟史40年，因咳嗽、咳痰、活动后气促10年，加重1周入院。患者诉慢性咳嗽、咳白色黏痰，活动后气促明显。查体：桶状胸，双肺呼吸音低，可闻及散在干啰音。肺功能检查示：FEV1/FVC 60%，FEV1占预计值55%。诊断为慢性阻塞性肺疾病急性加重期。"
+    }
+]
+
+_SAMPLE_RESPONSES = [
+    json_dumps({"sample_cases": _SAMPLE_CASES, "recommended": case})
+    for case in _SAMPLE_CASES
+]
+
+
 @router.get("/sample")
 async def get_sample_case():
     """获取样例病例文本"""
-    sample_cases = [
-        {
-            "title": "急性心肌梗死",
-            "text": "患者，男性，65岁，因突发胸痛3小时入院。患者诉胸闷、胸痛，疼痛呈压榨样，向左肩及左臂放射，伴大汗、恶心。既往有高血压病史10年。查体：BP 140/90mmHg，心率90次/分，律齐，心音低钝，双肺未闻及干湿啰音。心电图示：V1-V4导联ST段弓背向上抬高。肌钙蛋白I升高。诊断为急性前壁心肌梗死。"
-        },
-        {
-            "title": "心力衰竭",
-            "text": "患者，女性，72岁，因活动后气促、双下肢水肿1个月入院。患者既往有冠心病、高血压病史20年。查体：BP 150/95mmHg，心率100次/分，房颤心律，双肺底可闻及湿啰音，心脏扩大，心尖区可闻及奔马律，双下肢中度凹陷性水肿。胸部X线示：心影增大，肺淤血。超声心动图示：左心室扩大，射血分数35%。诊断为慢性心力衰竭。"
-        },
-        {
-            "title": "肺炎",
-            "text": "患者，男性，45岁，因发热、咳嗽、咳痰5天入院。患者诉发热，体温最高39℃，伴咳嗽、咳黄痰，量多，无胸痛、咯血。查体：T 38.5℃，P 95次/分，R 22次/分，BP 120/80mmHg，右肺下叶可闻及湿啰音。血常规：WBC 12.5×10^9/L，N 85%。胸部CT示：右肺下叶实变影。诊断为社区获得性肺炎。"
-        },
-        {
-            "title": "糖尿病",
-            "text": "患者，女性，58岁，因多饮、多尿、多食、体重下降2个月就诊。既往无特殊病史。查体：BP 130/80mmHg，心率80次/分，双下肢无水肿。随机血糖：15.6mmol/L，HbA1c：9.2%。诊断为2型糖尿病。"
-        },
-        {
-            "title": "慢性阻塞性肺疾病",
-            "text": "患者，男性，68岁，吸烟史40年，因咳嗽、咳痰、活动后气促10年，加重1周入院。患者诉慢性咳嗽、咳白色黏痰，活动后气促明显。查体：桶状胸，双肺呼吸音低，可闻及散在干啰音。肺功能检查示：FEV1/FVC 60%，FEV1占预计值55%。诊断为慢性阻塞性肺疾病急性加重期。"
-        }
-    ]
-    
-    import random
-    return {
-        "sample_cases": sample_cases,
-        "recommended": random.choice(sample_cases)
-    }
+    return Response(content=random.choice(_SAMPLE_RESPONSES), media_type="application/json")
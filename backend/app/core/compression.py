@@ -0,0 +1,32 @@
+"""响应压缩模块（Gzip，跳过逐条推送的流式响应）"""
+from starlette.datastructures import Headers
+from starlette.middleware.gzip import GZipMiddleware, GZipResponder, IdentityResponder
+from starlette.types import Message, Receive, Scope, Send
+
+# GZipResponder 不按块刷新，会把整段输出攒在缓冲区里，流式记录无法逐条到达客户端
+STREAMING_CONTENT_TYPES = ("text/event-stream", "application/x-ndjson")
+
+
+class _StreamAwareGZipResponder(GZipResponder):
+    """内容类型属于流式类型时原样透传响应体"""
+    
+    async def send_with_compression(self, message: Message) -> None:
+        await super().send_with_compression(message)
+        if message["type"] == "http.response.start":
+            content_type = Headers(raw=message["headers"]).get("content-type", "")
+            self.content_type_is_excluded = content_type.startswith(STREAMING_CONTENT_TYPES)
+
+
+class StreamAwareGZipMiddleware(GZipMiddleware):
+    """Gzip压缩中间件，NDJSON / SSE 流式响应不压缩"""
+    
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        
+        if "gzip" in Headers(scope=scope).get("Accept-Encoding", ""):
+            responder = _StreamAwareGZipResponder(self.app, self.minimum_size, compresslevel=self.compresslevel)
+        else:
+            responder = IdentityResponder(self.app, self.minimum_size)
+        await responder(scope, receive, send)
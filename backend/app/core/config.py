@@ -18,6 +18,8 @@ class Settings(BaseSettings):
     MODEL_DIR: str = "models"
     AVAILABLE_MODELS: List[str] = ["CAML", "DCAN", "Fusion", "TransICD"]
     DEFAULT_MODEL: str = "CAML"
+    MODEL_COPY_STRATEGY: str = "auto"  # auto（硬链接→reflink→复制）, hardlink, reflink, copy
+    MODEL_REPO_BACKEND: str = "json"  # 模型元数据存储：json（metadata.json）, sqlite（metadata.db）
     
     # LLM配置
     LLM_PROVIDER: str = "openai"  # openai, anthropic, local
@@ -28,22 +30,31 @@ class Settings(BaseSettings):
     # 知识图谱配置
     GRAPH_DB_TYPE: str = "json"  # json, neo4j, nebula
     GRAPH_DB_URL: Optional[str] = None
+    NEO4J_DATABASE: str = "neo4j"  # Neo4j数据库名（显式指定可省去服务端的默认库查找）
+    NEO4J_POOL_SIZE: int = 50  # Neo4j驱动连接池大小
+    NEBULA_POOL_SIZE: int = 16  # NebulaGraph会话池大小
     ICD_HIERARCHY_PATH: str = "app/data/icd_hierarchy.json"
     UMLS_MAPPINGS_PATH: str = "app/data/umls_mappings.json"
     
     # 数据库配置
     DATABASE_TYPE: str = "json"  # json, mysql, mongodb
     DATABASE_URL: Optional[str] = None
+    DATABASE_POOL_SIZE: int = 25  # MySQL连接池最大连接数
     
     # 预测配置
     TOP_K: int = 10  # 返回top-k个ICD编码
     PREDICTION_THRESHOLD: float = 0.5  # 预测概率阈值
+    PREDICT_BATCH_MAX_SIZE: int = 64  # 批量预测单次请求最多病例数
+    PREDICT_BATCH_MAX_TEXT_LENGTH: int = 20000  # 批量预测单个病例文本的最大字符数
     
     # 预处理配置
     MAX_TEXT_LENGTH: int = 512
     REMOVE_STOPWORDS: bool = True
     KEEP_NUMBERS: bool = True
     
+    # 响应压缩配置（小于该字节数的响应不压缩）
+    COMPRESSION_MINIMUM_SIZE: int = 2048
+    
     # 测试模式配置（使用测试数据）
     USE_MOCK_MODE: bool = True  # 始终使用测试数据（默认True）
     
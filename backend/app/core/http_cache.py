@@ -0,0 +1,39 @@
+"""HTTP缓存模块（ETag / Cache-Control）"""
+import hashlib
+from typing import Callable, Optional
+from fastapi import HTTPException, Request, Response
+
+CACHE_CONTROL = "public, max-age=60, stale-while-revalidate=600"
+
+
+def _compute_etag(generation: int, key: str) -> str:
+    """根据数据版本号和请求键计算弱ETag"""
+    digest = hashlib.blake2b(key.encode('utf-8'), digest_size=8).hexdigest()
+    return f'W/"{generation}-{digest}"'
+
+
+def _request_key(request: Request) -> str:
+    """请求路径加排序后的查询参数，参数顺序不同的同一请求共享ETag"""
+    params = sorted(request.query_params.multi_items())
+    return request.url.path + '?' + '&'.join(f"{k}={v}" for k, v in params)
+
+
+def etag_for(get_generation: Optional[Callable[[], int]] = None):
+    """生成ETag依赖
+
+    get_generation 返回数据版本号（如 graph_manager.generation），数据变化后ETag自动失效；
+    静态数据不传，版本号固定为0。客户端 If-None-Match 命中时直接返回304，跳过处理函数。
+    """
+    def dependency(request: Request, response: Response) -> str:
+        generation = get_generation() if get_generation else 0
+        etag = _compute_etag(generation, _request_key(request))
+        headers = {"ETag": etag, "Cache-Control": CACHE_CONTROL}
+
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match and (if_none_match.strip() == "*" or etag in [t.strip() for t in if_none_match.split(",")]):
+            raise HTTPException(status_code=304, headers=headers)
+
+        response.headers.update(headers)
+        return etag
+
+    return dependency
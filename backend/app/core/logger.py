@@ -27,7 +27,7 @@ def setup_logger(name: str = "icd_autocoder", log_level: int = logging.INFO) ->
     log_dir = Path("logs")
     log_dir.mkdir(exist_ok=True)
     file_handler = logging.FileHandler(log_dir / "app.log", encoding='utf-8')
-    file_handler.setLevel(logging.DEBUG)
+    file_handler.setLevel(log_level)
     file_formatter = logging.Formatter(
         '%(asctime)s - %(name)s - %(levelname)s - [%(filename)s:%(lineno)d] - %(message)s',
         datefmt='%Y-%m-%d %H:%M:%S'
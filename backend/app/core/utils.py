@@ -1,36 +1,240 @@
 """工具函数模块"""
-from typing import Dict, List, Any, Optional
+from typing import Dict, List, Any, Optional, Iterable, Iterator, Sequence, Tuple, BinaryIO
+import copy
 import json
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from functools import lru_cache
 from pathlib import Path
 
+try:
+    import orjson
+except ImportError:  # 未安装orjson时回退到标准库json
+    orjson = None
+
+
+def json_dumps(data: Any, indent: bool = False) -> bytes:
+    """序列化为UTF-8编码的JSON字节串（中文不转义）"""
+    if orjson is not None:
+        option = orjson.OPT_NON_STR_KEYS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(data, option=option)
+    return json.dumps(data, ensure_ascii=False, indent=2 if indent else None).encode('utf-8')
+
+
+def json_loads(raw: bytes) -> Any:
+    """解析JSON字节串"""
+    if orjson is not None:
+        return orjson.loads(raw)
+    return json.loads(raw)
+
 
 def load_json(file_path: str) -> Dict[str, Any]:
     """加载JSON文件"""
     path = Path(file_path)
     if not path.exists():
         return {}
-    with open(path, 'r', encoding='utf-8') as f:
-        return json.load(f)
+    return json_loads(path.read_bytes())
+
+
+class TTLCache:
+    """线程安全的LRU+TTL缓存（超过maxsize淘汰最久未使用的条目，超过ttl秒的条目失效）"""
+    
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[Any, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+    
+    def get(self, key: Any) -> Any:
+        """返回缓存值的副本，未命中或已过期返回None"""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._data[key]
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            value = entry[1]
+        return copy.deepcopy(value)
+    
+    def set(self, key: Any, value: Any) -> None:
+        value = copy.deepcopy(value)
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            if len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+    
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+    
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / total if total else 0.0
+            }
+
+
+@lru_cache(maxsize=256)
+def _ensure_dir(directory: str) -> None:
+    """创建目录（每个目录只检查一次）"""
+    Path(directory).mkdir(parents=True, exist_ok=True)
+
+
+def _mkstemp_beside(path: Path) -> Tuple[int, str]:
+    """在目标文件同目录创建临时文件"""
+    directory = str(path.parent)
+    _ensure_dir(directory)
+    try:
+        return tempfile.mkstemp(dir=directory, prefix=f".{path.name}.", suffix=".tmp")
+    except FileNotFoundError:
+        # 目录在缓存后被删除
+        _ensure_dir.cache_clear()
+        _ensure_dir(directory)
+        return tempfile.mkstemp(dir=directory, prefix=f".{path.name}.", suffix=".tmp")
+
+
+def _commit_temp(tmp_path: str, path: Path) -> None:
+    os.chmod(tmp_path, 0o644)
+    os.replace(tmp_path, path)
+
+
+def _discard_temp(tmp_path: str) -> None:
+    try:
+        os.unlink(tmp_path)
+    except OSError:
+        pass
+
+
+@contextmanager
+def atomic_write(file_path: str) -> Iterator[BinaryIO]:
+    """原子写文件：先写入同目录临时文件，完成后os.replace替换目标
+    
+    读取方（如重新加载图谱数据）不会读到写了一半的文件，写入中途失败也不会破坏原文件。
+    """
+    path = Path(file_path)
+    fd, tmp_path = _mkstemp_beside(path)
+    try:
+        with os.fdopen(fd, 'wb', buffering=1 << 20) as f:
+            yield f
+        _commit_temp(tmp_path, path)
+    except BaseException:
+        _discard_temp(tmp_path)
+        raise
+
+
+def atomic_write_bytes(file_path: str, data: bytes) -> None:
+    """原子写入完整字节串：直接对文件描述符写入，部分写入时用memoryview切片推进，不复制剩余数据"""
+    path = Path(file_path)
+    fd, tmp_path = _mkstemp_beside(path)
+    try:
+        try:
+            view = memoryview(data)
+            while view:
+                written = os.write(fd, view)
+                view = view[written:]
+        finally:
+            os.close(fd)
+        _commit_temp(tmp_path, path)
+    except BaseException:
+        _discard_temp(tmp_path)
+        raise
 
 
 def save_json(data: Dict[str, Any], file_path: str) -> None:
     """保存JSON文件"""
-    path = Path(file_path)
-    path.parent.mkdir(parents=True, exist_ok=True)
-    with open(path, 'w', encoding='utf-8') as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
+    atomic_write_bytes(file_path, json_dumps(data, indent=True))
+
+
+def save_json_stream(
+    header: Dict[str, Any],
+    stream_key: str,
+    entries: Iterable[Tuple[str, Any]],
+    file_path: str,
+    indent: bool = False
+) -> None:
+    """流式保存JSON文件：header中的字段之后，以stream_key写入由entries逐项编码的对象
+    
+    每个条目单独编码并写入缓冲的临时文件（原子替换），不在内存中拼出整个文件的编码结果；
+    输出与 save_json({**header, stream_key: dict(entries)}) 一致。
+    """
+    # JSON字符串中的换行总是被转义，替换原始换行即可整体缩进嵌套值
+    newline, sep = (b"\n", b": ") if indent else (b"", b":")
+    pad1, pad2 = (b"  ", b"    ") if indent else (b"", b"")
+    
+    def nested(value: Any, pad: bytes) -> bytes:
+        encoded = json_dumps(value, indent=indent)
+        return encoded.replace(b"\n", b"\n" + pad) if indent else encoded
+    
+    with atomic_write(file_path) as f:
+        f.write(b"{" + newline)
+        for key, value in header.items():
+            f.write(pad1 + json_dumps(key) + sep + nested(value, pad1) + b"," + newline)
+        f.write(pad1 + json_dumps(stream_key) + sep + b"{")
+        first = True
+        for key, value in entries:
+            f.write((b"" if first else b",") + newline + pad2 + json_dumps(key) + sep + nested(value, pad2))
+            first = False
+        if not first:
+            f.write(newline + pad1)
+        f.write(b"}" + newline + b"}")
+
+
+# ASCII范围内除数字和点以外的字符删除表
+_ICD_ASCII_DELETE = str.maketrans('', '', ''.join(
+    chr(i) for i in range(128) if not (chr(i).isdigit() or chr(i) == '.')
+))
 
 
 def format_icd_code(icd: str) -> str:
     """格式化ICD编码"""
     # 移除空格和特殊字符，保留点和数字
+    if icd.isascii():
+        return icd.translate(_ICD_ASCII_DELETE)
+    # 含非ASCII字符（如全角数字）时逐字符判断，与str.isdigit语义保持一致
     return ''.join(c for c in icd if c.isdigit() or c == '.')
 
 
-def calculate_confidence(probabilities: List[float]) -> float:
-    """计算置信度（取最大值或平均值）"""
-    if not probabilities:
+@lru_cache(maxsize=8192)
+def icd_code_prefixes(code: str) -> Tuple[str, ...]:
+    """ICD编码各层级的前缀（例如：410.71 -> ('410', '410.7', '410.71')）
+    
+    同一编码在各次预测中反复出现，按编码缓存切分与拼接结果
+    """
+    parts = code.split('.')
+    prefixes = [parts[0]]
+    for part in parts[1:]:
+        prefixes.append(prefixes[-1] + '.' + part)
+    return tuple(prefixes)
+
+
+def calculate_confidence(probabilities: Sequence[float]) -> float:
+    """计算置信度（取最大值或平均值）
+    
+    传入numpy数组等自带max归约的序列时直接调用其C实现，不逐元素装箱比较
+    """
+    if len(probabilities) == 0:
         return 0.0
+    reduce_max = getattr(probabilities, 'max', None)
+    if callable(reduce_max):
+        return float(reduce_max())
     return max(probabilities)
 
 
@@ -45,27 +249,31 @@ def merge_predictions(
     if weights is None:
         weights = [1.0 / len(predictions)] * len(predictions)
     
-    # 合并相同ICD编码的预测
-    merged = {}
+    # 合并相同ICD编码的预测：先在并行的概率/计数表中累加，最后一次性构建结果字典
+    totals: Dict[Any, float] = {}
+    counts: Dict[Any, int] = {}
+    names: Dict[Any, str] = {}
     for pred, weight in zip(predictions, weights):
         for item in pred.get('results', []):
             icd = item.get('icd_code')
             prob = item.get('probability', 0.0)
             
-            if icd not in merged:
-                merged[icd] = {
-                    'icd_code': icd,
-                    'icd_name': item.get('icd_name', ''),
-                    'probability': 0.0,
-                    'count': 0
-                }
-            
-            merged[icd]['probability'] += prob * weight
-            merged[icd]['count'] += 1
-    
-    # 转换为列表并排序
-    result = list(merged.values())
-    result.sort(key=lambda x: x['probability'], reverse=True)
+            if icd in totals:
+                totals[icd] += prob * weight
+                counts[icd] += 1
+            else:
+                totals[icd] = 0.0 + prob * weight  # 与从0.0开始累加的结果类型一致
+                counts[icd] = 1
+                names[icd] = item.get('icd_name', '')
     
-    return result
+    # 按概率排序后转换为列表
+    return [
+        {
+            'icd_code': icd,
+            'icd_name': names[icd],
+            'probability': totals[icd],
+            'count': counts[icd]
+        }
+        for icd in sorted(totals, key=totals.__getitem__, reverse=True)
+    ]
 
@@ -0,0 +1,35 @@
+"""请求体校验模块"""
+from typing import Any, Callable, Dict, Type, TypeVar
+from fastapi import Request
+from fastapi.exceptions import RequestValidationError
+from pydantic import BaseModel, ValidationError
+
+ModelT = TypeVar('ModelT', bound=BaseModel)
+
+
+def json_body(model: Type[ModelT]) -> Callable[[Request], Any]:
+    """生成请求体解析依赖
+
+    直接用 model_validate_json 在 pydantic-core 中一次完成原始字节的JSON解析和校验，
+    省去 FastAPI 默认的 json.loads 转 dict 再逐字段校验的两遍处理。
+    校验失败时抛出 RequestValidationError，保持原有的422响应格式。
+    """
+    async def dependency(request: Request) -> ModelT:
+        raw = await request.body()
+        try:
+            return model.model_validate_json(raw)
+        except ValidationError as e:
+            errors = [{**error, 'loc': ('body', *error['loc'])} for error in e.errors(include_url=False)]
+            raise RequestValidationError(errors, body=raw)
+
+    return dependency
+
+
+def json_body_openapi(model: Type[BaseModel]) -> Dict[str, Any]:
+    """通过 json_body 解析的接口在OpenAPI文档中的请求体描述"""
+    return {
+        "requestBody": {
+            "required": True,
+            "content": {"application/json": {"schema": model.model_json_schema()}}
+        }
+    }
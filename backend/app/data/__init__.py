@@ -1,7 +1,11 @@
 """数据层模块"""
-from app.data.model_repository import ModelRepository
-from app.data.graph_database import GraphDatabase
-from app.data.case_storage import CaseStorage
+from app.data.model_repository import ModelRepository, get_model_repository
+from app.data.graph_database import GraphDatabase, get_graph_database
+from app.data.case_storage import CaseStorage, get_case_storage
 
-__all__ = ['ModelRepository', 'GraphDatabase', 'CaseStorage']
+__all__ = [
+    'ModelRepository', 'get_model_repository',
+    'GraphDatabase', 'get_graph_database',
+    'CaseStorage', 'get_case_storage'
+]
 
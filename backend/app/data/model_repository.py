@@ -1,11 +1,190 @@
 """模型权重仓库模块"""
-from typing import Dict, List, Optional, Any
+from typing import Dict, Iterator, List, Optional, Any
+from abc import ABC, abstractmethod
 from pathlib import Path
-import json
+import os
 import shutil
+import sqlite3
+import threading
+from contextlib import contextmanager
 from datetime import datetime
 from app.core.config import settings
 from app.core.logger import logger
+from app.core.utils import json_dumps, json_loads, save_json
+
+try:
+    import fcntl
+except ImportError:  # 非Unix平台没有fcntl，不支持reflink
+    fcntl = None
+
+# Linux FICLONE ioctl：在支持写时复制的文件系统（Btrfs/XFS）上克隆文件，不复制数据块
+_FICLONE = 0x40049409
+
+
+def _hardlink(src: Path, dst: Path) -> None:
+    os.link(src, dst)
+
+
+def _reflink(src: Path, dst: Path) -> None:
+    if fcntl is None:
+        raise OSError("当前平台不支持reflink")
+    with open(src, 'rb') as src_file, open(dst, 'wb') as dst_file:
+        try:
+            fcntl.ioctl(dst_file.fileno(), _FICLONE, src_file.fileno())
+        except OSError:
+            dst_file.close()
+            dst.unlink()
+            raise
+    shutil.copystat(src, dst)
+
+
+_COPY_STRATEGIES = {
+    'auto': (_hardlink, _reflink),
+    'hardlink': (_hardlink,),
+    'reflink': (_reflink,),
+    'copy': ()
+}
+
+
+def _fast_copy(src: Path, dst: Path) -> None:
+    """导入模型权重文件：按 MODEL_COPY_STRATEGY 依次尝试硬链接、reflink，都不可用时完整复制
+    
+    硬链接和reflink只修改文件系统元数据，同一文件系统内导入数GB的权重也是常数时间。
+    """
+    if dst.exists():
+        if os.path.samefile(src, dst):
+            return
+        dst.unlink()
+    for link in _COPY_STRATEGIES.get(settings.MODEL_COPY_STRATEGY, _COPY_STRATEGIES['auto']):
+        try:
+            link(src, dst)
+            return
+        except OSError:
+            continue
+    shutil.copy2(src, dst)
+
+
+# 模型列表默认只返回的摘要字段（完整记录含嵌套的 metadata，按需通过 detail=True 获取）
+_SUMMARY_KEYS = ('name', 'version', 'provider', 'file_size')
+
+
+def _summarize(model_info: Dict[str, Any]) -> Dict[str, Any]:
+    return {k: model_info[k] for k in _SUMMARY_KEYS if k in model_info}
+
+
+# 元数据中按模型类型分组的字段
+_MODEL_SECTIONS = ('small_models', 'llm_models')
+
+
+def _empty_metadata() -> Dict[str, Any]:
+    return {
+        'small_models': {},
+        'llm_models': {},
+        'last_updated': datetime.now().isoformat()
+    }
+
+
+class _MetadataBackend(ABC):
+    """模型元数据持久化后端：内存中的 metadata 字典是唯一读取来源，后端只负责持久化"""
+    
+    @abstractmethod
+    def load(self) -> Dict[str, Any]:
+        pass
+    
+    def put(self, section: str, name: str, info: Dict[str, Any]) -> None:
+        """记录一条新增或修改的模型（在 flush 时持久化）"""
+    
+    def delete(self, section: str, name: str) -> None:
+        """记录一条删除的模型（在 flush 时持久化）"""
+    
+    @abstractmethod
+    def flush(self, metadata: Dict[str, Any]) -> None:
+        pass
+
+
+class _JsonMetadataBackend(_MetadataBackend):
+    """metadata.json：每次保存整体重写文件"""
+    
+    def __init__(self, path: Path):
+        self.path = path
+    
+    def load(self) -> Dict[str, Any]:
+        if self.path.exists():
+            try:
+                return json_loads(self.path.read_bytes())
+            except Exception as e:
+                logger.error(f"加载模型元数据失败: {str(e)}")
+                return {}
+        return _empty_metadata()
+    
+    def flush(self, metadata: Dict[str, Any]) -> None:
+        save_json(metadata, str(self.path))
+
+
+# SQLite 后端的 user_version：达到该值表示已处理过 metadata.json 的导入
+_SQLITE_IMPORTED_VERSION = 1
+
+
+class _SqliteMetadataBackend(_MetadataBackend):
+    """SQLite（WAL）：每个模型一行，注册和删除只写改动的行，不重写整个元数据"""
+    
+    def __init__(self, path: Path, json_path: Path):
+        self.path = path
+        self.json_path = json_path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS models ("
+            "type TEXT NOT NULL, name TEXT NOT NULL, version TEXT, info BLOB NOT NULL, "
+            "PRIMARY KEY (type, name)) WITHOUT ROWID"
+        )
+        self._conn.commit()
+    
+    def load(self) -> Dict[str, Any]:
+        metadata = _empty_metadata()
+        with self._lock:
+            rows = self._conn.execute("SELECT type, name, info FROM models").fetchall()
+            imported = self._conn.execute("PRAGMA user_version").fetchone()[0] >= _SQLITE_IMPORTED_VERSION
+        if not imported:
+            # 只在首次启用时导入一次（以 user_version 记录）；之后表为空表示模型已全部删除，不再导入
+            if not rows and self.json_path.exists():
+                metadata = self._import_json(metadata)
+            with self._lock:
+                self._conn.execute(f"PRAGMA user_version = {_SQLITE_IMPORTED_VERSION}")
+                self._conn.commit()
+            if not rows:
+                return metadata
+        for section, name, info in rows:
+            metadata.setdefault(section, {})[name] = json_loads(info)
+        return metadata
+    
+    def _import_json(self, metadata: Dict[str, Any]) -> Dict[str, Any]:
+        """首次启用时导入已有的 metadata.json"""
+        legacy = _JsonMetadataBackend(self.json_path).load()
+        for section in _MODEL_SECTIONS:
+            for name, info in legacy.get(section, {}).items():
+                metadata[section][name] = info
+                self.put(section, name, info)
+        self.flush(metadata)
+        logger.info(f"已从 {self.json_path} 导入模型元数据")
+        return metadata
+    
+    def put(self, section: str, name: str, info: Dict[str, Any]) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO models (type, name, version, info) VALUES (?, ?, ?, ?)",
+                (section, name, info.get('version'), json_dumps(info))
+            )
+    
+    def delete(self, section: str, name: str) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM models WHERE type = ? AND name = ?", (section, name))
+    
+    def flush(self, metadata: Dict[str, Any]) -> None:
+        with self._lock:
+            self._conn.commit()
 
 
 class ModelRepository:
@@ -18,33 +197,99 @@ class ModelRepository:
         self.metadata_file = self.base_dir / "metadata.json"
         self.small_models_dir.mkdir(parents=True, exist_ok=True)
         self.llm_models_dir.mkdir(parents=True, exist_ok=True)
+        if settings.MODEL_REPO_BACKEND == "sqlite":
+            self._backend: _MetadataBackend = _SqliteMetadataBackend(self.base_dir / "metadata.db", self.metadata_file)
+        else:
+            self._backend = _JsonMetadataBackend(self.metadata_file)
         self.metadata = self._load_metadata()
+        # batch() 嵌套深度；批量期间只标记脏数据，退出最外层时写一次元数据
+        self._batch_depth = 0
+        self._dirty = False
+        # 小模型权重路径缓存：初始化时校验一次，之后的查询不再访问文件系统
+        self._path_cache: Dict[str, str] = {}
+        self.refresh()
     
     def _load_metadata(self) -> Dict[str, Any]:
-        if self.metadata_file.exists():
-            try:
-                with open(self.metadata_file, 'r', encoding='utf-8') as f:
-                    return json.load(f)
-            except Exception as e:
-                logger.error(f"加载模型元数据失败: {str(e)}")
-                return {}
-        return {
-            'small_models': {},
-            'llm_models': {},
-            'last_updated': datetime.now().isoformat()
-        }
+        return self._backend.load()
     
     def _save_metadata(self) -> bool:
         """保存模型元数据"""
         try:
             self.metadata['last_updated'] = datetime.now().isoformat()
-            with open(self.metadata_file, 'w', encoding='utf-8') as f:
-                json.dump(self.metadata, f, ensure_ascii=False, indent=2)
+            self._backend.flush(self.metadata)
+            self._dirty = False
             return True
         except Exception as e:
             logger.error(f"保存模型元数据失败: {str(e)}")
             return False
     
+    def _set_model(self, section: str, name: str, info: Dict[str, Any]) -> None:
+        """写入一条模型元数据"""
+        self.metadata.setdefault(section, {})[name] = info
+        self._backend.put(section, name, info)
+        self._mark_dirty()
+    
+    def _delete_model(self, section: str, name: str) -> None:
+        """删除一条模型元数据"""
+        del self.metadata[section][name]
+        self._backend.delete(section, name)
+        self._mark_dirty()
+    
+    def _mark_dirty(self) -> None:
+        """元数据已修改：批量期间延后保存，否则立即保存"""
+        self._dirty = True
+        if self._batch_depth == 0:
+            self._save_metadata()
+    
+    @contextmanager
+    def batch(self) -> Iterator["ModelRepository"]:
+        """批量修改元数据，退出最外层时只保存一次（JSON后端只重写一次 metadata.json）
+        
+        例如：
+            with model_repository.batch():
+                for ...:
+                    model_repository.register_small_model(...)
+        """
+        self._batch_depth += 1
+        try:
+            yield self
+        finally:
+            self._batch_depth -= 1
+            if self._batch_depth == 0 and self._dirty:
+                self._save_metadata()
+    
+    def register_many(self, models: List[Dict[str, Any]]) -> int:
+        """批量注册小模型，每项为 register_small_model 的关键字参数
+        
+        Returns:
+            int: 注册成功的数量
+        """
+        with self.batch():
+            return sum(1 for model in models if self.register_small_model(**model))
+    
+    def _resolve_model_path(self, model_info: Dict[str, Any]) -> Optional[str]:
+        """校验并返回模型文件的实际路径（先试绝对路径，再从相对路径构建）"""
+        full_path = model_info.get('full_path')
+        if full_path and Path(full_path).exists():
+            return full_path
+        
+        relative_path = model_info.get('path')
+        if relative_path:
+            full_path = self.base_dir / relative_path
+            if full_path.exists():
+                return str(full_path.resolve())
+        
+        return None
+    
+    def refresh(self) -> None:
+        """重新校验所有小模型的权重文件路径"""
+        path_cache = {}
+        for model_name, model_info in self.metadata.get('small_models', {}).items():
+            path = self._resolve_model_path(model_info)
+            if path:
+                path_cache[model_name] = path
+        self._path_cache = path_cache
+    
     def register_small_model(self, model_name: str, model_path: str, version: str = "1.0.0", description: Optional[str] = None, metadata: Optional[Dict[str, Any]] = None) -> bool:
         """注册小模型权重"""
         try:
@@ -59,24 +304,20 @@ class ModelRepository:
             
             # 复制模型文件
             dest_path = model_dir / model_file.name
-            shutil.copy2(model_file, dest_path)
+            _fast_copy(model_file, dest_path)
             
             # 记录元数据
-            if 'small_models' not in self.metadata:
-                self.metadata['small_models'] = {}
-            
-            self.metadata['small_models'][model_name] = {
+            self._path_cache[model_name] = str(dest_path.resolve())
+            self._set_model('small_models', model_name, {
                 'name': model_name,
                 'version': version,
                 'path': str(dest_path.relative_to(self.base_dir)),
-                'full_path': str(dest_path),
+                'full_path': str(dest_path.resolve()),
                 'description': description or f"{model_name} model",
                 'registered_at': datetime.now().isoformat(),
                 'file_size': model_file.stat().st_size,
                 'metadata': metadata or {}
-            }
-            
-            self._save_metadata()
+            })
             logger.info(f"注册小模型: {model_name} v{version}")
             return True
         
@@ -124,18 +365,14 @@ class ModelRepository:
                     model_dir.mkdir(parents=True, exist_ok=True)
                     
                     dest_path = model_dir / model_file.name
-                    shutil.copy2(model_file, dest_path)
+                    _fast_copy(model_file, dest_path)
                     
                     model_info['path'] = str(dest_path.relative_to(self.base_dir))
-                    model_info['full_path'] = str(dest_path)
+                    model_info['full_path'] = str(dest_path.resolve())
                     model_info['file_size'] = model_file.stat().st_size
             
             # 记录元数据
-            if 'llm_models' not in self.metadata:
-                self.metadata['llm_models'] = {}
-            
-            self.metadata['llm_models'][model_name] = model_info
-            self._save_metadata()
+            self._set_model('llm_models', model_name, model_info)
             logger.info(f"注册LLM模型: {model_name} ({provider})")
             return True
         
@@ -146,13 +383,15 @@ class ModelRepository:
     def get_small_model_path(
         self,
         model_name: str,
-        version: Optional[str] = None
+        version: Optional[str] = None,
+        force_revalidate: bool = False
     ) -> Optional[str]:
         """获取小模型权重文件路径
         
         Args:
             model_name: 模型名称
             version: 模型版本，如果不指定则返回最新版本
+            force_revalidate: 重新检查文件是否存在（默认直接返回注册/刷新时校验过的路径）
             
         Returns:
             str: 模型文件路径，如果不存在返回None
@@ -165,18 +404,15 @@ class ModelRepository:
         if version and model_info.get('version') != version:
             return None
         
-        full_path = model_info.get('full_path')
-        if full_path and Path(full_path).exists():
-            return full_path
+        if not force_revalidate:
+            return self._path_cache.get(model_name)
         
-        # 尝试从相对路径构建
-        relative_path = model_info.get('path')
-        if relative_path:
-            full_path = self.base_dir / relative_path
-            if full_path.exists():
-                return str(full_path)
-        
-        return None
+        path = self._resolve_model_path(model_info)
+        if path:
+            self._path_cache[model_name] = path
+        else:
+            self._path_cache.pop(model_name, None)
+        return path
     
     def get_llm_model_info(self, model_name: str) -> Optional[Dict[str, Any]]:
         """获取LLM模型信息
@@ -189,13 +425,15 @@ class ModelRepository:
         """
         return self.metadata.get('llm_models', {}).get(model_name)
     
-    def list_small_models(self) -> List[Dict[str, Any]]:
-        """列出所有已注册的小模型"""
-        return list(self.metadata.get('small_models', {}).values())
+    def list_small_models(self, detail: bool = False) -> List[Dict[str, Any]]:
+        """列出所有已注册的小模型（detail=False 时只返回摘要字段）"""
+        models = self.metadata.get('small_models', {}).values()
+        return list(models) if detail else [_summarize(m) for m in models]
     
-    def list_llm_models(self) -> List[Dict[str, Any]]:
-        """列出所有已注册的LLM模型"""
-        return list(self.metadata.get('llm_models', {}).values())
+    def list_llm_models(self, detail: bool = False) -> List[Dict[str, Any]]:
+        """列出所有已注册的LLM模型（detail=False 时只返回摘要字段）"""
+        models = self.metadata.get('llm_models', {}).values()
+        return list(models) if detail else [_summarize(m) for m in models]
     
     def remove_small_model(self, model_name: str, version: Optional[str] = None) -> bool:
         """删除小模型
@@ -227,8 +465,8 @@ class ModelRepository:
                     shutil.rmtree(model_dir)
             
             # 删除元数据
-            del self.metadata['small_models'][model_name]
-            self._save_metadata()
+            self._path_cache.pop(model_name, None)
+            self._delete_model('small_models', model_name)
             
             logger.info(f"删除小模型: {model_name}")
             return True
@@ -254,6 +492,24 @@ class ModelRepository:
         return None
 
 
-# 全局模型仓库实例
-model_repository = ModelRepository()
+# 全局模型仓库实例（首次使用时才创建）
+_model_repository: Optional[ModelRepository] = None
+_model_repository_lock = threading.Lock()
+
+
+def get_model_repository() -> ModelRepository:
+    """获取全局模型仓库实例"""
+    global _model_repository
+    if _model_repository is None:
+        with _model_repository_lock:
+            if _model_repository is None:
+                _model_repository = ModelRepository()
+    return _model_repository
+
+
+def __getattr__(name: str) -> Any:
+    """兼容旧的 `from app.data.model_repository import model_repository` 写法"""
+    if name == 'model_repository':
+        return get_model_repository()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
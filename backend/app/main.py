@@ -1,13 +1,19 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 from app.api import predict, graph, explain, llm, models, performance
+from app.services.batching import close_all_batchers
+from app.data.graph_database import get_graph_database
 from app.core.config import settings
+from app.core.compression import StreamAwareGZipMiddleware
 from app.core.logger import logger
 
 app = FastAPI(
     title=settings.API_TITLE,
     version=settings.API_VERSION,
-    description="智能ICD自动编码前后端交互系统"
+    description="智能ICD自动编码前后端交互系统",
+    # 所有路由默认用orjson序列化响应，嵌套节点较多的图谱接口编码更快
+    default_response_class=ORJSONResponse
 )
 
 # 配置CORS
@@ -19,6 +25,9 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# 响应压缩（/graph/visualize等大JSON重复键多，压缩比高），/graph/visualize/stream 的NDJSON记录不压缩以便逐条送达
+app.add_middleware(StreamAwareGZipMiddleware, minimum_size=settings.COMPRESSION_MINIMUM_SIZE)
+
 # 注册路由
 app.include_router(predict.router, prefix="/predict", tags=["Predict"])
 app.include_router(graph.router, prefix="/graph", tags=["Graph"])
@@ -51,9 +60,13 @@ async def startup_event():
     logger.info("ICD Auto Coder Backend 启动中...")
     logger.info(f"API版本: {settings.API_VERSION}")
     logger.info(f"可用模型: {settings.AVAILABLE_MODELS}")
+    # 在开始服务前连接图数据库，首个请求不承担建连开销
+    get_graph_database()
 
 
 @app.on_event("shutdown")
 async def shutdown_event():
     """应用关闭事件"""
     logger.info("ICD Auto Coder Backend 关闭中...")
+    await close_all_batchers()
+    get_graph_database().disconnect()
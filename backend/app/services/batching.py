@@ -0,0 +1,135 @@
+"""异步微批处理模块"""
+import asyncio
+from typing import Any, Callable, List, Optional, Tuple
+from app.core.logger import logger
+
+
+class AsyncBatcher:
+    """异步微批处理器
+
+    将短时间窗口内到达的请求合并为一次批量调用，摊薄预处理和模型推理的固定开销。
+    batch_fn 接收请求列表并返回等长的结果列表，在线程池中执行以免阻塞事件循环。
+    提供 length_fn 时按长度分桶：同一子批次内最长/最短不超过 max_length_ratio 倍，
+    避免短输入被填充到长输入的长度。
+    """
+
+    def __init__(
+        self,
+        batch_fn: Callable[[List[Any]], List[Any]],
+        max_batch_size: int = 16,
+        max_wait_ms: float = 10,
+        length_fn: Optional[Callable[[Any], int]] = None,
+        max_length_ratio: float = 1.5
+    ):
+        self.batch_fn = batch_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.length_fn = length_fn
+        self.max_length_ratio = max_length_ratio
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        _batchers.append(self)
+
+    def _ensure_worker(self) -> None:
+        """在当前事件循环中启动后台批处理任务"""
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop or self._worker is None or self._worker.done():
+            self._loop = loop
+            self._queue = asyncio.Queue()
+            self._worker = loop.create_task(self._run())
+
+    async def submit(self, item: Any) -> Any:
+        """提交单个请求，等待所在批次处理完成后返回对应结果"""
+        self._ensure_worker()
+        future = self._loop.create_future()
+        await self._queue.put((item, future))
+        return await future
+
+    async def _collect(self) -> List[Tuple[Any, asyncio.Future]]:
+        """收集一个批次：最多max_batch_size个请求或等待max_wait_ms"""
+        batch = [await self._queue.get()]
+        deadline = self._loop.time() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - self._loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    def _bucket(self, batch: List[Tuple[Any, asyncio.Future]]) -> List[List[Tuple[Any, asyncio.Future]]]:
+        """按输入长度排序后切分为长度相近的子批次"""
+        if self.length_fn is None or len(batch) <= 1:
+            return [batch]
+        ordered = sorted(((max(self.length_fn(item), 1), item, future) for item, future in batch), key=lambda x: x[0])
+        groups: List[List[Tuple[Any, asyncio.Future]]] = []
+        group: List[Tuple[Any, asyncio.Future]] = []
+        group_min = 0
+        for length, item, future in ordered:
+            if group and length > group_min * self.max_length_ratio:
+                groups.append(group)
+                group = []
+            if not group:
+                group_min = length
+            group.append((item, future))
+        groups.append(group)
+        return groups
+
+    async def _process(self, batch: List[Tuple[Any, asyncio.Future]]) -> None:
+        """执行一个（子）批次并回填结果
+        
+        整批失败时逐个重试，只有出错的输入对应的请求失败；返回结果数量不符时，
+        未得到结果的请求以异常结束，不会一直等待。
+        """
+        items = [item for item, _ in batch]
+        try:
+            results = await asyncio.to_thread(self.batch_fn, items)
+        except Exception as e:
+            logger.error(f"批处理失败（批大小 {len(items)}）: {str(e)}")
+            if len(batch) > 1:
+                await asyncio.gather(*[self._process([entry]) for entry in batch])
+            else:
+                self._fail(batch, e)
+            return
+        
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+        if len(results) != len(batch):
+            logger.error(f"批处理返回结果数量不符（批大小 {len(batch)}，结果 {len(results)}）")
+            self._fail(batch, RuntimeError(f"批处理返回 {len(results)} 个结果，期望 {len(batch)} 个"))
+    
+    @staticmethod
+    def _fail(batch: List[Tuple[Any, asyncio.Future]], error: Exception) -> None:
+        """以异常结束批次中尚未完成的请求"""
+        for _, future in batch:
+            if not future.done():
+                future.set_exception(error)
+    
+    async def _run(self) -> None:
+        """后台批处理循环"""
+        while True:
+            batch = await self._collect()
+            await asyncio.gather(*[self._process(group) for group in self._bucket(batch)])
+
+    async def close(self) -> None:
+        """停止后台批处理任务"""
+        if self._worker and not self._worker.done():
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+        self._worker = None
+
+
+_batchers: List[AsyncBatcher] = []
+
+
+async def close_all_batchers() -> None:
+    """停止所有批处理器（应用关闭时调用）"""
+    for batcher in _batchers:
+        await batcher.close()
@@ -3,6 +3,15 @@ from typing import Dict, List, Optional, Any
 from app.core.logger import logger
 from app.services.graph_manager import graph_manager
 
+# 模拟注意力中与ICD编码相关的医学关键词，导入时构建一次
+_MEDICAL_KEYWORDS = frozenset({
+    'heart', 'cardiac', 'myocardial', 'infarction', 'chest', 'pain',
+    'acute', 'coronary', 'artery', 'disease', 'attack'
+})
+_KEYWORD_WEIGHT = 0.8
+_DIGIT_WEIGHT = 0.3
+_DEFAULT_WEIGHT = 0.1
+
 
 class Explainer:
     """解释器"""
@@ -24,21 +33,23 @@ class Explainer:
             # 生成模拟的注意力权重
             attention_weights = self._generate_mock_attention(tokens, icd_code)
         
-        # 将注意力权重与tokens对应
-        token_importances = []
-        for i, token in enumerate(tokens):
-            weight = attention_weights[i] if i < len(attention_weights) else 0.0
-            token_importances.append({
-                'token': token,
-                'weight': weight,
-                'importance': 'high' if weight > 0.7 else 'medium' if weight > 0.4 else 'low'
-            })
-        
-        # 排序
-        token_importances.sort(key=lambda x: x['weight'], reverse=True)
+        # 将注意力权重与tokens对应（缺少权重的token记为0）
+        weights = list(attention_weights[:len(tokens)])
+        weights.extend([0.0] * (len(tokens) - len(weights)))
+        
+        # 按权重对下标排序（稳定排序，等权重保持原顺序），只为排序后的结果构建字典
+        order = sorted(range(len(tokens)), key=weights.__getitem__, reverse=True)
+        token_importances = [
+            {
+                'token': tokens[i],
+                'weight': weights[i],
+                'importance': 'high' if weights[i] > 0.7 else 'medium' if weights[i] > 0.4 else 'low'
+            }
+            for i in order
+        ]
         
         # 提取关键词（权重最高的前N个）
-        keywords = [item['token'] for item in token_importances[:10]]
+        keywords = [tokens[i] for i in order[:10]]
         
         return {
             'icd_code': icd_code,
@@ -49,33 +60,54 @@ class Explainer:
             'explanation': f"关键词 {', '.join(keywords[:5])} 对预测ICD编码 {icd_code} 贡献最大。"
         }
     
+    def explain_with_gradients_batch(
+        self,
+        items: List[Dict[str, Any]]
+    ) -> List[Dict[str, Any]]:
+        """批量计算注意力解释
+        
+        items中每个元素为explain_with_gradients的关键字参数。接入真实模型时在此处将整批tokens
+        填充到同一长度后做一次前向计算，再按请求拆分注意力权重；模拟权重与ICD编码无关，
+        相同tokens只计算一次。
+        """
+        weights_cache: Dict[tuple, List[float]] = {}
+        results = []
+        for item in items:
+            if item.get('attention_weights') is None:
+                key = tuple(item['tokens'])
+                if key not in weights_cache:
+                    weights_cache[key] = self._generate_mock_attention(item['tokens'], item['icd_code'])
+                item = {**item, 'attention_weights': weights_cache[key]}
+            results.append(self.explain_with_gradients(**item))
+        return results
+    
     def _generate_mock_attention(
         self, 
         tokens: List[str],
         icd_code: str
     ) -> List[float]:
         """生成模拟注意力权重"""
-        weights = []
-        
-        # 根据token与ICD编码的相关性分配权重
-        medical_keywords = {
-            'heart', 'cardiac', 'myocardial', 'infarction', 'chest', 'pain',
-            'acute', 'coronary', 'artery', 'disease', 'attack'
-        }
-        
-        for token in tokens:
-            if token in medical_keywords:
-                weights.append(0.8)
-            elif token.isdigit():
-                weights.append(0.3)
-            else:
-                weights.append(0.1)
-        
-        # 归一化
-        max_weight = max(weights) if weights else 1.0
-        weights = [w / max_weight if max_weight > 0 else 0.1 for w in weights]
-        
-        return weights
+        if not tokens:
+            return []
+        
+        # 权重只有三档，最大值可以先确定：有关键词时为关键词权重（集合判交在C中完成），否则看有无数字
+        if not _MEDICAL_KEYWORDS.isdisjoint(tokens):
+            max_weight = _KEYWORD_WEIGHT
+        elif any(token.isdigit() for token in tokens):
+            max_weight = _DIGIT_WEIGHT
+        else:
+            max_weight = _DEFAULT_WEIGHT
+        
+        # 根据token与ICD编码的相关性分配权重，归一化后的三档权重预先算好，一次遍历直接输出
+        keyword_weight = _KEYWORD_WEIGHT / max_weight
+        digit_weight = _DIGIT_WEIGHT / max_weight
+        default_weight = _DEFAULT_WEIGHT / max_weight
+        return [
+            keyword_weight if token in _MEDICAL_KEYWORDS
+            else digit_weight if token.isdigit()
+            else default_weight
+            for token in tokens
+        ]
     
     def explain_with_graph_path(
         self,
@@ -180,6 +212,16 @@ class Explainer:
             'comprehensive_explanation': ' '.join(explanation_text_parts),
             'methods_used': ['attention' if use_attention else None, 'graph' if use_graph else None]
         }
+    
+    def generate_comprehensive_explanation_batch(
+        self,
+        items: List[Dict[str, Any]]
+    ) -> List[Dict[str, Any]]:
+        """批量生成综合解释
+        
+        items中每个元素为generate_comprehensive_explanation的关键字参数
+        """
+        return [self.generate_comprehensive_explanation(**item) for item in items]
 
 
 # 全局解释器实例
@@ -1,104 +1,198 @@
 """知识图谱管理模块"""
-from typing import Dict, List, Optional, Any
+import bisect
+import hashlib
+import os
+import pickle
+import threading
+from functools import lru_cache
+from typing import Dict, FrozenSet, List, Optional, Any, Set, Tuple
 from pathlib import Path
 from app.core.config import settings
 from app.core.logger import logger
-from app.core.utils import load_json
+from app.core.utils import atomic_write_bytes, load_json
 
+# 解析后的数据与搜索索引的本地快照：数据文件内容不变时冷启动直接反序列化，跳过JSON解析和建索引
+# 快照结构变化时递增版本号，旧快照自动作废
+_SNAPSHOT_VERSION = 4
+_SNAPSHOT_SUFFIX = '.snapshot.pkl'
+# 快照文件头：魔数 + 版本号 + 数据文件内容摘要 + 以该摘要为密钥的快照内容摘要，校验通过后才反序列化
+_SNAPSHOT_MAGIC = b'ICDSNAP'
+_SNAPSHOT_DIGEST_SIZE = 32
+_SNAPSHOT_HEADER_SIZE = len(_SNAPSHOT_MAGIC) + 1 + 2 * _SNAPSHOT_DIGEST_SIZE
+_SNAPSHOT_ATTRS = (
+    'icd_hierarchy', 'umls_mappings', 'latest_predictions', 'latest_metadata',
+    '_search_ngram_index', '_short_query_signatures',
+    '_codes', '_code_order', '_name_lowers', '_sorted_codes', '_normalized_code_order',
+    '_name_word_index', '_name_word_counts', '_name_word_sets', '_name_lower_index',
+    '_umls_terms', '_umls_ngram_index',
+)
 
-class GraphManager:
-    """知识图谱管理器"""
+
+@lru_cache(maxsize=8192)
+def _string_similarity(str1: str, str2: str) -> float:
+    """字符串相似度（只取决于两个字符串，与图谱数据版本无关，重新加载数据时无需清空）"""
+    if str1 in str2 or str2 in str1:
+        return 0.8
+    words1 = set(str1.split())
+    words2 = set(str2.split())
+    if not words1 or not words2:
+        return 0.0
+    intersection = words1.intersection(words2)
+    union = words1.union(words2)
+    return len(intersection) / len(union) if union else 0.0
+
+
+# 常用医学概念的同义词表，导入时构建一次
+# 表中存在互为同义词的条目，语义检索只展开一层同义词
+_MAX_SYNONYM_DEPTH = 1
+_MEDICAL_SYNONYMS: Dict[str, Tuple[str, ...]] = {
+    'heart attack': ('myocardial infarction', 'mi', 'acute myocardial infarction', 'cardiac infarction'),
+    'myocardial infarction': ('heart attack', 'mi', 'acute myocardial infarction', 'cardiac infarction'),
+    'mi': ('myocardial infarction', 'heart attack', 'acute myocardial infarction'),
+    'chest pain': ('thoracic pain', 'precordial pain', 'angina'),
+    'shortness of breath': ('dyspnea', 'difficulty breathing', 'breathlessness'),
+    'dyspnea': ('shortness of breath', 'difficulty breathing', 'breathlessness'),
+    'hypertension': ('high blood pressure', 'htn', 'elevated blood pressure'),
+    'htn': ('hypertension', 'high blood pressure'),
+    'diabetes': ('dm', 'diabetes mellitus', 'diabetic'),
+    'dm': ('diabetes', 'diabetes mellitus'),
+    'pneumonia': ('lung infection', 'pulmonary infection', 'respiratory infection'),
+    'fever': ('pyrexia', 'elevated temperature', 'hyperthermia'),
+    'headache': ('cephalgia', 'head pain', 'migraine'),
+    'nausea': ('queasiness', 'feeling sick', 'stomach upset'),
+    'vomiting': ('emesis', 'throwing up', 'regurgitation')
+}
+
+
+class _GraphState:
+    """单个数据版本的图谱数据与搜索索引
     
-    def __init__(self):
-        self.icd_hierarchy = {}
-        self.umls_mappings = {}
-        self.latest_predictions = {}
-        self.latest_metadata = {}
-        self._load_data()
-    
-    def _load_data(self):
-        """加载知识图谱数据"""
-        try:
-            icd_path = Path(settings.ICD_HIERARCHY_PATH)
-            if icd_path.exists():
-                data = load_json(str(icd_path))
-                # 检查是否是新的格式（包含predictions数据）
-                if 'predictions' in data:
-                    # 新格式：从predictions中提取icd_hierarchy
-                    self.icd_hierarchy = data.get('icd_hierarchy', {})
-                    self.latest_predictions = data.get('predictions', {})
-                    self.latest_metadata = {
-                        'timestamp': data.get('timestamp', ''),
-                        'original_text': data.get('original_text', ''),
-                        'model': data.get('model', ''),
-                        'top_k': data.get('top_k', 10),
-                        'threshold': data.get('threshold', 0.5)
-                    }
-                    logger.info(f"已加载最新预测结果（时间戳: {self.latest_metadata.get('timestamp', 'N/A')}）")
-                else:
-                    # 旧格式：直接使用icd_hierarchy
-                    self.icd_hierarchy = data if isinstance(data, dict) else {}
-                    self.latest_predictions = {}
-                    self.latest_metadata = {}
-                    logger.info("采用旧的格式")
-            else:
-                logger.warning(f"ICD层次结构文件不存在: {icd_path}")
-                self.icd_hierarchy = self._init_default_icd_hierarchy()
-                self.latest_predictions = {}
-                self.latest_metadata = {}
-            
-            umls_path = Path(settings.UMLS_MAPPINGS_PATH)
-            if umls_path.exists():
-                self.umls_mappings = load_json(str(umls_path))
-            else:
-                logger.warning(f"UMLS映射文件不存在: {umls_path}")
-                self.umls_mappings = {}
-        except Exception as e:
-            logger.error(f"加载知识图谱数据失败: {str(e)}")
-            self.icd_hierarchy = self._init_default_icd_hierarchy()
-            self.latest_predictions = {}
-            self.latest_metadata = {}
+    构建完成后只读。重新加载时先在局部构建新实例，再以一次属性赋值整体发布；
+    查询在每次调用开始时取一次引用，整个调用期间看到的都是同一版本的数据和索引。
+    """
     
-    def reload_data(self):
-        """重新加载数据（用于获取最新的预测结果）"""
-        self._load_data()
+    def __init__(
+        self,
+        generation: int,
+        icd_hierarchy: Dict[str, Any],
+        umls_mappings: Dict[str, Any],
+        latest_predictions: Dict[str, Any],
+        latest_metadata: Dict[str, Any]
+    ):
+        # 数据版本号：由数据文件的修改时间和大小计算，多worker进程加载同一份数据时取值一致
+        self.generation = generation
+        self.icd_hierarchy = icd_hierarchy
+        self.umls_mappings = umls_mappings
+        self.latest_predictions = latest_predictions
+        self.latest_metadata = latest_metadata
+        self._build_search_index()
+        self._init_caches()
     
-    def get_latest_predictions(self) -> Dict[str, Any]:
-        """获取最新的预测结果"""
-        self.reload_data()
-        return self.latest_predictions
+    @classmethod
+    def from_snapshot(cls, generation: int, data: Dict[str, Any]) -> "_GraphState":
+        """由快照恢复（数据与索引直接取自快照，不重新建索引）"""
+        state = cls.__new__(cls)
+        state.generation = generation
+        for attr in _SNAPSHOT_ATTRS:
+            setattr(state, attr, data[attr])
+        state._init_caches()
+        return state
     
-    def get_latest_metadata(self) -> Dict[str, Any]:
-        """获取最新预测的元数据"""
-        return self.latest_metadata
+    def _init_caches(self) -> None:
+        """本版本的图谱遍历结果缓存
+        
+        缓存随实例一起发布和替换：仍在旧版本上进行的计算只会写入旧实例的缓存，不会污染新版本
+        """
+        self.query_icd = lru_cache(maxsize=4096)(self._query_icd)
+        self.get_hierarchy_path = lru_cache(maxsize=4096)(self._get_hierarchy_path)
+        self.get_related_nodes = lru_cache(maxsize=4096)(self._get_related_nodes)
+        self.explain_icd_path = lru_cache(maxsize=4096)(self._explain_icd_path)
+        self._path_codes_cache = lru_cache(maxsize=4096)(self._get_path_codes)
     
-    def _init_default_icd_hierarchy(self) -> Dict[str, Any]:
-        return {
-            "410": {
-                "code": "410",
-                "name": "Acute myocardial infarction",
-                "parent": None,
-                "children": ["410.0", "410.1", "410.7", "410.9"],
-                "level": 1
-            },
-            "410.7": {
-                "code": "410.7",
-                "name": "Subendocardial infarction",
-                "parent": "410",
-                "children": ["410.71"],
-                "level": 2
-            },
-            "410.71": {
-                "code": "410.71",
-                "name": "Subendocardial infarction, initial episode",
-                "parent": "410.7",
-                "children": [],
-                "level": 3
-            }
-        }
+    def to_snapshot(self) -> Dict[str, Any]:
+        return {attr: getattr(self, attr) for attr in _SNAPSHOT_ATTRS}
     
-    def query_icd(self, icd_code: str) -> Optional[Dict[str, Any]]:
-        """查询ICD编码信息"""
+    def _build_search_index(self) -> None:
+        """构建ICD搜索索引：编码/名称三元组倒排索引（子串查找）"""
+        # 编码序号即层次结构中的原始顺序；小写名称按序号预先计算，查询时不再逐条转换
+        self._codes = list(self.icd_hierarchy)
+        self._code_order = {code: i for i, code in enumerate(self._codes)}
+        self._name_lowers = [self.icd_hierarchy[code].get('name', '').lower() for code in self._codes]
+        # 索引按小写编码建立（必要条件，召回的候选仍按原始编码确认）
+        lowered = [(code, code.lower(), name_lower) for code, name_lower in zip(self._codes, self._name_lowers)]
+        
+        ngram_index: Dict[str, Set[str]] = {}
+        for code, code_lower, name_lower in lowered:
+            for field in (code_lower, name_lower):
+                for gram in self._ngrams(field):
+                    ngram_index.setdefault(gram, set()).add(code)
+        self._search_ngram_index = ngram_index
+        # 不足三个字符的关键词用不了三元组索引，为每个条目预计算单字符/双字符的64位Bloom签名做预过滤
+        self._short_query_signatures = [
+            (code, self._short_signature(code_lower) | self._short_signature(name_lower))
+            for code, code_lower, name_lower in lowered
+        ]
+        
+        # 模糊匹配用：区分大小写的编码有序表（前缀范围查找）+ 去点号编码到首个条目序号的映射
+        self._sorted_codes = sorted(self._codes)
+        normalized_order: Dict[str, int] = {}
+        for i, code in enumerate(self._codes):
+            normalized_order.setdefault(code.replace('.', ''), i)
+        self._normalized_code_order = normalized_order
+        
+        # 语义相似度检索用：名称单词倒排索引（词重叠候选）+ 小写名称索引（名称被概念包含的候选）
+        # 单词倒排表存整数序号元组而非编码字符串集合，内存更紧凑
+        word_index: Dict[str, List[int]] = {}
+        word_counts: List[int] = []
+        word_sets: List[FrozenSet[str]] = []
+        name_index: Dict[str, List[str]] = {}
+        for i, (code, name) in enumerate(zip(self._codes, self._name_lowers)):
+            name_index.setdefault(name, []).append(code)
+            words = set(name.split())
+            word_counts.append(len(words))
+            word_sets.append(frozenset(words))
+            for word in words:
+                word_index.setdefault(word, []).append(i)
+        self._name_word_index = {word: tuple(ids) for word, ids in word_index.items()}
+        self._name_word_counts = word_counts
+        self._name_word_sets = word_sets
+        self._name_lower_index = name_index
+        
+        # UMLS同义词/别名/概念名：按原始顺序展开为 (编码, 原词, 小写词) 列表，并建立三元组倒排索引
+        umls_terms: List[Tuple[str, str, str]] = []
+        umls_ngram_index: Dict[str, Set[int]] = {}
+        for icd_code, umls_data in self.umls_mappings.items():
+            if not isinstance(umls_data, dict):
+                continue
+            all_terms = umls_data.get('synonyms', []) + umls_data.get('aliases', []) + umls_data.get('concept_names', [])
+            for term in all_terms:
+                if isinstance(term, str):
+                    term_lower = term.lower()
+                    for gram in self._ngrams(term_lower):
+                        umls_ngram_index.setdefault(gram, set()).add(len(umls_terms))
+                    umls_terms.append((icd_code, term, term_lower))
+        self._umls_terms = umls_terms
+        self._umls_ngram_index = umls_ngram_index
+    
+    @staticmethod
+    def _ngrams(text: str, n: int = 3) -> Set[str]:
+        """提取字符串的n元组"""
+        return {text[i:i + n] for i in range(len(text) - n + 1)}
+    
+    @staticmethod
+    def _short_signature(text: str) -> int:
+        """字符串中单字符与双字符的64位Bloom签名"""
+        signature = 0
+        prev = None
+        for ch in text:
+            c = ord(ch)
+            signature |= 1 << (c & 63)
+            if prev is not None:
+                signature |= 1 << ((prev * 31 + c) & 63)
+            prev = c
+        return signature
+    
+    def _query_icd(self, icd_code: str) -> Optional[Dict[str, Any]]:
         # 直接使用原始编码查询（保留点号）
         if icd_code in self.icd_hierarchy:
             return self.icd_hierarchy[icd_code]
@@ -106,17 +200,62 @@ class GraphManager:
         icd_code_no_dot = icd_code.replace('.', '')
         if icd_code_no_dot in self.icd_hierarchy:
             return self.icd_hierarchy[icd_code_no_dot]
-        # 模糊匹配
-        for code, info in self.icd_hierarchy.items():
-            code_normalized = code.replace('.', '')
-            if code == icd_code or code_normalized == icd_code_no_dot:
-                return info
-            if code.startswith(icd_code) or icd_code.startswith(code):
-                return info
-        return None
+        # 模糊匹配：在去点号相同、以该编码为前缀、是该编码前缀的条目中取层次结构里最靠前的一个
+        best = self._normalized_code_order.get(icd_code_no_dot, len(self._codes))
+        order = self._code_order
+        for end in range(1, len(icd_code)):
+            i = order.get(icd_code[:end])
+            if i is not None and i < best:
+                best = i
+        codes = self._sorted_codes
+        i = bisect.bisect_left(codes, icd_code)
+        while i < len(codes) and codes[i].startswith(icd_code):
+            if order[codes[i]] < best:
+                best = order[codes[i]]
+            i += 1
+        return self.icd_hierarchy[self._codes[best]] if best < len(self._codes) else None
     
-    def get_hierarchy_path(self, icd_code: str) -> List[Dict[str, str]]:
-        """获取ICD编码的层次路径"""
+    def search_icd(self, query: str, limit: int = 10) -> List[Dict[str, Any]]:
+        """按编码或名称搜索ICD编码
+        
+        返回编码包含关键词或名称（小写）包含关键词的条目，按层次结构中的原始顺序取前limit个
+        （limit不大于0时与逐条扫描一致，返回首个命中）。通过三元组倒排索引召回候选，
+        关键词不足三个字符时用Bloom签名预过滤。
+        """
+        query_lower = query.lower()
+        limit = max(limit, 1)
+        
+        grams = self._ngrams(query_lower)
+        if grams:
+            postings = sorted((self._search_ngram_index.get(g, set()) for g in grams), key=len)
+            candidates = sorted(set.intersection(*postings), key=self._code_order.__getitem__)
+        else:
+            # 关键词过短，无法使用三元组索引，先用Bloom签名跳过不可能匹配的条目（列表已按原始顺序排列）
+            query_signature = self._short_signature(query_lower)
+            candidates = [
+                code for code, signature in self._short_query_signatures
+                if signature & query_signature == query_signature
+            ]
+        
+        matched: List[str] = []
+        order = self._code_order
+        name_lowers = self._name_lowers
+        for code in candidates:
+            if query_lower in code or query_lower in name_lowers[order[code]]:
+                matched.append(code)
+                if len(matched) >= limit:
+                    break
+        
+        return [
+            {
+                'code': code,
+                'name': self.icd_hierarchy[code].get('name', ''),
+                'level': self.icd_hierarchy[code].get('level', 0)
+            }
+            for code in matched
+        ]
+    
+    def _get_hierarchy_path(self, icd_code: str) -> List[Dict[str, str]]:
         path = []
         icd_info = self.query_icd(icd_code)
         if not icd_info:
@@ -131,69 +270,96 @@ class GraphManager:
                 break
         return path
     
-    def get_related_nodes(self, icd_code: str, depth: int = 2) -> Dict[str, List[Dict[str, Any]]]:
-        """获取相关节点"""
+    def _get_related_nodes(self, icd_code: str, depth: int = 2) -> Dict[str, List[Dict[str, Any]]]:
         icd_info = self.query_icd(icd_code)
         if not icd_info:
             return {'nodes': [], 'edges': []}
         
-        # 添加当前节点，包含概率信息
-        current_node = {
-            'id': icd_info['code'],
-            'label': icd_info.get('name', icd_code) or icd_code,
-            'level': icd_info.get('level', 0),
-            'type': 'icd',
-            'probability': icd_info.get('probability', 0.0)
+        # 节点按编码直接写入字典去重（重复编码保留首次出现的位置），不再先建列表再转换
+        code = icd_info['code']
+        probability = icd_info.get('probability', 0.0)
+        nodes: Dict[str, Dict[str, Any]] = {
+            code: {
+                'id': code,
+                'label': icd_info.get('name', icd_code) or icd_code,
+                'level': icd_info.get('level', 0),
+                'type': 'icd',
+                'probability': probability
+            }
         }
-        nodes = [current_node]
         edges = []
         
         if icd_info.get('parent'):
             parent_info = self.query_icd(icd_info['parent'])
             if parent_info:
+                parent_code = parent_info['code']
                 parent_prob = parent_info.get('probability', 0.0)
-                nodes.append({
-                    'id': parent_info['code'],
-                    'label': parent_info.get('name', parent_info['code']) or parent_info['code'],
+                nodes[parent_code] = {
+                    'id': parent_code,
+                    'label': parent_info.get('name', parent_code) or parent_code,
                     'level': parent_info.get('level', 0),
                     'type': 'icd',
                     'probability': parent_prob
-                })
+                }
                 weight = max(parent_prob, icd_info.get('probability', 0.5))
                 edges.append({
-                    'source': parent_info['code'],
-                    'target': icd_info['code'],
+                    'source': parent_code,
+                    'target': code,
                     'type': 'parent-child',
                     'weight': weight if weight > 0 else 0.5
                 })
         
+        edge_prob = icd_info.get('probability', 0.5)
         for child_code in icd_info.get('children', []):
             child_info = self.query_icd(child_code)
             if child_info:
                 child_prob = child_info.get('probability', 0.0)
-                nodes.append({
+                nodes[child_info['code']] = {
                     'id': child_info['code'],
                     'label': child_info.get('name', child_code) or child_code,
                     'level': child_info.get('level', 0),
                     'type': 'icd',
                     'probability': child_prob
-                })
-                weight = max(icd_info.get('probability', 0.5), child_prob)
+                }
+                weight = max(edge_prob, child_prob)
                 edges.append({
-                    'source': icd_info['code'],
+                    'source': code,
                     'target': child_code,
                     'type': 'parent-child',
                     'weight': weight if weight > 0 else 0.5
                 })
         
-        unique_nodes = {node['id']: node for node in nodes}
-        return {'nodes': list(unique_nodes.values()), 'edges': edges}
+        return {'nodes': list(nodes.values()), 'edges': edges}
+    
+    def get_related_nodes_batch(self, icd_codes: List[str], depth: int = 2) -> Dict[str, Any]:
+        """批量获取多个ICD编码的相关节点
+        
+        每个编码各自取 get_related_nodes 的（缓存）结果，只在合并nodes/edges时去重，
+        related中为每个编码各自的相关节点，与逐个调用 get_related_nodes 一致
+        """
+        nodes: Dict[str, Dict[str, Any]] = {}
+        edges: Dict[Tuple[str, str, str], Dict[str, Any]] = {}
+        related: Dict[str, List[Dict[str, Any]]] = {}
+        for icd_code in icd_codes:
+            result = self.get_related_nodes(icd_code, depth)
+            related[icd_code] = result['nodes']
+            for node in result['nodes']:
+                nodes[node['id']] = node
+            for edge in result['edges']:
+                edges.setdefault((edge['source'], edge['target'], edge.get('type', '')), edge)
+        return {'nodes': list(nodes.values()), 'edges': list(edges.values()), 'related': related}
     
     def filter_icd_by_constraints(self, candidates: List[Dict[str, Any]], constraints: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
         """根据语义约束过滤ICD编码"""
         if not constraints:
             return candidates
         
+        # 约束只解析一次；祖先判断使用按编码缓存的层次路径编码集合
+        min_level = constraints.get('min_level')
+        max_level = constraints.get('max_level')
+        has_parent = 'parent_code' in constraints
+        parent_code = constraints.get('parent_code')
+        
         filtered = []
         for candidate in candidates:
             icd_code = candidate.get('icd_code', '')
@@ -201,22 +367,22 @@ class GraphManager:
             if not icd_info:
                 continue
             
-            if 'min_level' in constraints and icd_info.get('level', 0) < constraints['min_level']:
+            level = icd_info.get('level', 0)
+            if min_level is not None and level < min_level:
+                continue
+            if max_level is not None and level > max_level:
                 continue
-            if 'max_level' in constraints and icd_info.get('level', 0) > constraints['max_level']:
+            if has_parent and icd_info.get('parent') != parent_code and parent_code not in self._path_codes_cache(icd_code):
                 continue
-            if 'parent_code' in constraints:
-                if icd_info.get('parent') != constraints['parent_code']:
-                    path = self.get_hierarchy_path(icd_code)
-                    parent_codes = [p['code'] for p in path]
-                    if constraints['parent_code'] not in parent_codes:
-                        continue
             
             filtered.append(candidate)
         return filtered
     
-    def explain_icd_path(self, icd_code: str) -> Dict[str, Any]:
-        """解释ICD编码的知识路径"""
+    def _get_path_codes(self, icd_code: str) -> FrozenSet[str]:
+        """层次路径上的全部编码（含自身）"""
+        return frozenset(p['code'] for p in self.get_hierarchy_path(icd_code))
+    
+    def _explain_icd_path(self, icd_code: str) -> Dict[str, Any]:
         icd_info = self.query_icd(icd_code)
         if not icd_info:
             return {'icd_code': icd_code, 'exists': False, 'message': f'ICD编码 {icd_code} 未找到'}
@@ -237,89 +403,393 @@ class GraphManager:
             'description': f"该ICD编码位于第{icd_info.get('level', 0)}层，属于{hierarchy_path[0]['name'] if hierarchy_path else '未知'}类别"
         }
     
-    def search_semantic_similarity(self, concept: str, threshold: float = 0.7, max_results: int = 10) -> List[Dict[str, Any]]:
-        """语义相似度检索"""
+    def search_semantic_similarity(
+        self,
+        concept: str,
+        threshold: float = 0.7,
+        max_results: int = 10,
+        _depth: int = 0,
+        _visited: Optional[Set[str]] = None
+    ) -> List[Dict[str, Any]]:
+        """语义相似度检索
+        
+        同义词最多展开 _MAX_SYNONYM_DEPTH 层，_visited 记录已检索过的概念，互为同义词的概念不会重复检索。
+        """
         concept_lower = concept.lower()
+        _visited = set() if _visited is None else _visited
+        _visited.add(concept_lower)
         results = []
+        # 已加入结果的编码（同一编码只保留最先匹配的一条）
+        seen: Set[str] = set()
         
-        for icd_code, umls_data in self.umls_mappings.items():
-            if isinstance(umls_data, dict):
-                all_terms = umls_data.get('synonyms', []) + umls_data.get('aliases', []) + umls_data.get('concept_names', [])
-                for term in all_terms:
-                    if isinstance(term, str) and concept_lower in term.lower():
-                        icd_info = self.query_icd(icd_code)
-                        if icd_info:
-                            results.append({
-                                'icd_code': icd_code,
-                                'icd_name': icd_info.get('name', ''),
-                                'matched_term': term,
-                                'similarity': 0.9,
-                                'source': 'umls'
-                            })
-        
-        for icd_code, icd_info in self.icd_hierarchy.items():
-            name = icd_info.get('name', '').lower()
-            similarity = self._calculate_string_similarity(concept_lower, name)
-            if similarity >= threshold:
-                if not any(r['icd_code'] == icd_code for r in results):
-                    results.append({
-                        'icd_code': icd_code,
-                        'icd_name': icd_info.get('name', ''),
-                        'matched_term': icd_info.get('name', ''),
-                        'similarity': similarity,
-                        'source': 'icd_hierarchy'
-                    })
-        
-        medical_synonyms = self._get_medical_synonyms()
-        if concept_lower in medical_synonyms:
-            for synonym in medical_synonyms[concept_lower]:
-                synonym_results = self.search_semantic_similarity(synonym, threshold=threshold, max_results=max_results)
-                for result in synonym_results:
-                    if not any(r['icd_code'] == result['icd_code'] for r in results):
-                        result['matched_term'] = f"{concept} (via {synonym})"
-                        result['similarity'] = min(1.0, result['similarity'] * 0.9)
-                        results.append(result)
-        
-        seen_codes = set()
-        unique_results = []
-        for result in sorted(results, key=lambda x: x['similarity'], reverse=True):
-            if result['icd_code'] not in seen_codes:
-                seen_codes.add(result['icd_code'])
-                unique_results.append(result)
-                if len(unique_results) >= max_results:
-                    break
-        return unique_results
+        for icd_code, term in self._umls_term_matches(concept_lower):
+            if icd_code in seen:
+                continue
+            icd_info = self.query_icd(icd_code)
+            if icd_info:
+                seen.add(icd_code)
+                results.append({
+                    'icd_code': icd_code,
+                    'icd_name': icd_info.get('name', ''),
+                    'matched_term': term,
+                    'similarity': 0.9,
+                    'source': 'umls'
+                })
+        
+        # 与 _calculate_string_similarity 结果相同：概念分词只做一次，名称分词使用预先构建的单词集合
+        concept_words = set(concept_lower.split())
+        word_sets = self._name_word_sets
+        name_lowers = self._name_lowers
+        order = self._code_order
+        for icd_code in self._similarity_candidates(concept_lower, threshold):
+            icd_info = self.icd_hierarchy[icd_code]
+            i = order[icd_code]
+            name = name_lowers[i]
+            if concept_lower in name or name in concept_lower:
+                similarity = 0.8
+            else:
+                name_words = word_sets[i]
+                if not concept_words or not name_words:
+                    similarity = 0.0
+                else:
+                    inter = len(concept_words & name_words)
+                    similarity = inter / (len(concept_words) + len(name_words) - inter)
+            if similarity >= threshold and icd_code not in seen:
+                seen.add(icd_code)
+                results.append({
+                    'icd_code': icd_code,
+                    'icd_name': icd_info.get('name', ''),
+                    'matched_term': icd_info.get('name', ''),
+                    'similarity': similarity,
+                    'source': 'icd_hierarchy'
+                })
+        
+        synonyms = _MEDICAL_SYNONYMS.get(concept_lower, ()) if _depth < _MAX_SYNONYM_DEPTH else ()
+        for synonym in synonyms:
+            if synonym in _visited:
+                continue
+            synonym_results = self.search_semantic_similarity(
+                synonym, threshold=threshold, max_results=max_results,
+                _depth=_depth + 1, _visited=_visited
+            )
+            for result in synonym_results:
+                if result['icd_code'] not in seen:
+                    seen.add(result['icd_code'])
+                    result['matched_term'] = f"{concept} (via {synonym})"
+                    result['similarity'] = min(1.0, result['similarity'] * 0.9)
+                    results.append(result)
+        
+        results.sort(key=lambda x: x['similarity'], reverse=True)
+        return results[:max_results]
     
-    def _calculate_string_similarity(self, str1: str, str2: str) -> float:
-        """计算字符串相似度"""
-        if str1 in str2 or str2 in str1:
-            return 0.8
-        words1 = set(str1.split())
-        words2 = set(str2.split())
-        if not words1 or not words2:
-            return 0.0
-        intersection = words1.intersection(words2)
-        union = words1.union(words2)
-        return len(intersection) / len(union) if union else 0.0
-    
-    def _get_medical_synonyms(self) -> Dict[str, List[str]]:
+    def _umls_term_matches(self, concept_lower: str) -> List[Tuple[str, str]]:
+        """包含概念的UMLS词条 (编码, 原词)，保持映射文件中的原始顺序
+        
+        概念不少于三个字符时先用三元组索引求交集得到候选，再逐个确认子串包含。
+        """
+        terms = self._umls_terms
+        grams = self._ngrams(concept_lower)
+        if grams:
+            postings = sorted((self._umls_ngram_index.get(g, set()) for g in grams), key=len)
+            candidates = sorted(set.intersection(*postings))
+        else:
+            candidates = range(len(terms))
+        return [
+            (terms[i][0], terms[i][1]) for i in candidates
+            if concept_lower in terms[i][2]
+        ]
+    
+    def _similarity_candidates(self, concept_lower: str, threshold: float) -> List[str]:
+        """通过索引召回可能达到相似度阈值的ICD编码（保持层次结构中的原始顺序）
+        
+        相似度只可能来自子串包含（0.8）或单词Jaccard重叠，因此候选为：
+        名称包含概念（三元组索引）、名称被概念包含（枚举概念子串）、与概念有共同单词（单词索引）。
+        无法用索引召回时退化为全量扫描。
+        """
+        max_substring_len = 64
+        if threshold <= 0 or len(concept_lower) < 3 or len(concept_lower) > max_substring_len:
+            return list(self.icd_hierarchy)
+        
+        candidates: Set[int] = set()
+        order = self._code_order
+        # 名称包含概念
+        postings = sorted((self._search_ngram_index.get(g, set()) for g in self._ngrams(concept_lower)), key=len)
+        candidates.update(order[code] for code in set.intersection(*postings))
+        # 名称被概念包含（含空名称）
+        n = len(concept_lower)
+        for i in range(n + 1):
+            for j in range(i, n + 1):
+                codes = self._name_lower_index.get(concept_lower[i:j])
+                if codes:
+                    candidates.update(order[code] for code in codes)
+        # 单词重叠：由倒排表累计共同单词数，直接按整数计算Jaccard，未达阈值的不进入精确打分
+        concept_words = set(concept_lower.split())
+        overlap: Dict[int, int] = {}
+        for word in concept_words:
+            for i in self._name_word_index.get(word, ()):
+                overlap[i] = overlap.get(i, 0) + 1
+        counts = self._name_word_counts
+        for i, inter in overlap.items():
+            if inter / (len(concept_words) + counts[i] - inter) >= threshold:
+                candidates.add(i)
+        
+        codes = self._codes
+        return [codes[i] for i in sorted(candidates)]
+
+
+class GraphManager:
+    """知识图谱管理器
+    
+    数据与索引保存在只读的 _GraphState 中，重新加载时整体替换，查询可在线程池中与重新加载并发执行
+    """
+    
+    def __init__(self):
+        # 重新加载互斥：同一时刻只有一个线程解析数据并发布新版本
+        self._lock = threading.Lock()
+        # 当前数据版本（含遍历结果缓存），重新加载时整体替换
+        self._state = _GraphState(0, {}, {}, {}, {})
+        with self._lock:
+            self._load_data(cold=True)
+    
+    @property
+    def generation(self) -> int:
+        return self._state.generation
+    
+    @property
+    def icd_hierarchy(self) -> Dict[str, Any]:
+        return self._state.icd_hierarchy
+    
+    @property
+    def umls_mappings(self) -> Dict[str, Any]:
+        return self._state.umls_mappings
+    
+    def _load_data(self, cold: bool = False):
+        """加载知识图谱数据（调用方需持有 _lock）
+        
+        只有冷启动（cold=True）读写快照；运行中每次预测保存后的重新加载直接解析，不重写快照
+        """
+        fingerprint = self._data_fingerprint()
+        source_digest = self._source_digest() if cold else b''
+        if cold:
+            state = self._load_snapshot(fingerprint, source_digest)
+            if state is not None:
+                self._state = state
+                return
+        
+        icd_hierarchy, umls_mappings, latest_predictions, latest_metadata, loaded = self._read_data_files()
+        state = _GraphState(fingerprint, icd_hierarchy, umls_mappings, latest_predictions, latest_metadata)
+        # 一次赋值发布新版本的数据、索引和（空的）遍历结果缓存
+        self._state = state
+        # 只为成功解析的数据文件保存快照，默认层次结构每次重新生成；解析期间文件被修改时不保存
+        if cold and loaded and self._source_digest() == source_digest:
+            self._save_snapshot(state, source_digest)
+    
+    def _read_data_files(self) -> Tuple[Dict[str, Any], Dict[str, Any], Dict[str, Any], Dict[str, Any], bool]:
+        """解析数据文件，返回 (层次结构, UMLS映射, 最新预测, 最新预测元数据, 是否成功解析层次结构文件)"""
+        icd_hierarchy: Dict[str, Any] = {}
+        # UMLS映射解析失败时沿用当前版本的映射
+        umls_mappings: Dict[str, Any] = self._state.umls_mappings
+        latest_predictions: Dict[str, Any] = {}
+        latest_metadata: Dict[str, Any] = {}
+        loaded = False
+        try:
+            icd_path = Path(settings.ICD_HIERARCHY_PATH)
+            if icd_path.exists():
+                data = load_json(str(icd_path))
+                # 检查是否是新的格式（包含predictions数据）
+                if 'predictions' in data:
+                    # 新格式：从predictions中提取icd_hierarchy
+                    icd_hierarchy = data.get('icd_hierarchy', {})
+                    latest_predictions = data.get('predictions', {})
+                    latest_metadata = {
+                        'timestamp': data.get('timestamp', ''),
+                        'original_text': data.get('original_text', ''),
+                        'model': data.get('model', ''),
+                        'top_k': data.get('top_k', 10),
+                        'threshold': data.get('threshold', 0.5)
+                    }
+                    logger.info(f"已加载最新预测结果（时间戳: {latest_metadata.get('timestamp', 'N/A')}）")
+                else:
+                    # 旧格式：直接使用icd_hierarchy
+                    icd_hierarchy = data if isinstance(data, dict) else {}
+                    logger.info("采用旧的格式")
+            else:
+                logger.warning(f"ICD层次结构文件不存在: {icd_path}")
+                icd_hierarchy = self._init_default_icd_hierarchy()
+            
+            umls_path = Path(settings.UMLS_MAPPINGS_PATH)
+            if umls_path.exists():
+                umls_mappings = load_json(str(umls_path))
+            else:
+                logger.warning(f"UMLS映射文件不存在: {umls_path}")
+                umls_mappings = {}
+            loaded = icd_path.exists()
+        except Exception as e:
+            logger.error(f"加载知识图谱数据失败: {str(e)}")
+            icd_hierarchy = self._init_default_icd_hierarchy()
+            latest_predictions = {}
+            latest_metadata = {}
+        return icd_hierarchy, umls_mappings, latest_predictions, latest_metadata, loaded
+    
+    @staticmethod
+    def _snapshot_path() -> Path:
+        return Path(settings.ICD_HIERARCHY_PATH + _SNAPSHOT_SUFFIX)
+    
+    @staticmethod
+    def _source_digest() -> bytes:
+        """数据文件内容摘要（快照按内容而非修改时间判断是否过期）"""
+        h = hashlib.blake2b(digest_size=_SNAPSHOT_DIGEST_SIZE)
+        for path in (settings.ICD_HIERARCHY_PATH, settings.UMLS_MAPPINGS_PATH):
+            try:
+                data = Path(path).read_bytes()
+            except OSError:
+                data = None
+            h.update(b'missing' if data is None else len(data).to_bytes(8, 'big') + data)
+        return h.digest()
+    
+    def _load_snapshot(self, fingerprint: int, source_digest: bytes) -> Optional[_GraphState]:
+        """文件头、数据文件摘要和快照内容摘要都校验通过时从快照恢复数据与索引，失败返回None
+        
+        快照位于可写的数据目录：只接受当前用户所有且其他用户不可写的文件，内容摘要不符时不反序列化
+        """
+        path = self._snapshot_path()
+        try:
+            stat = os.stat(path)
+            if (hasattr(os, 'getuid') and stat.st_uid != os.getuid()) or stat.st_mode & 0o022:
+                logger.warning(f"知识图谱快照权限不安全，已忽略: {path}")
+                return None
+            blob = path.read_bytes()
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning(f"读取知识图谱快照失败: {str(e)}")
+            return None
+        
+        header, payload = blob[:_SNAPSHOT_HEADER_SIZE], blob[_SNAPSHOT_HEADER_SIZE:]
+        if header != self._snapshot_header(source_digest, payload):
+            return None
+        try:
+            state = _GraphState.from_snapshot(fingerprint, pickle.loads(payload))
+        except Exception as e:
+            logger.warning(f"读取知识图谱快照失败: {str(e)}")
+            return None
+        logger.info("已从快照加载知识图谱数据")
+        return state
+    
+    def _save_snapshot(self, state: _GraphState, source_digest: bytes) -> None:
+        """保存数据与索引快照（失败不影响正常使用）"""
+        try:
+            payload = pickle.dumps(state.to_snapshot(), protocol=pickle.HIGHEST_PROTOCOL)
+            atomic_write_bytes(str(self._snapshot_path()), self._snapshot_header(source_digest, payload) + payload)
+        except Exception as e:
+            logger.warning(f"保存知识图谱快照失败: {str(e)}")
+    
+    @staticmethod
+    def _snapshot_header(source_digest: bytes, payload: bytes) -> bytes:
+        payload_digest = hashlib.blake2b(payload, digest_size=_SNAPSHOT_DIGEST_SIZE, key=source_digest).digest()
+        return _SNAPSHOT_MAGIC + bytes([_SNAPSHOT_VERSION]) + source_digest + payload_digest
+    
+    @staticmethod
+    def _data_fingerprint() -> int:
+        """数据文件指纹（用作generation，ETag据此在各worker进程间保持一致）"""
+        parts = []
+        for path in (settings.ICD_HIERARCHY_PATH, settings.UMLS_MAPPINGS_PATH):
+            try:
+                stat = os.stat(path)
+                parts.append(f"{path}:{stat.st_mtime_ns}:{stat.st_size}")
+            except OSError:
+                parts.append(f"{path}:missing")
+        digest = hashlib.blake2b('|'.join(parts).encode('utf-8'), digest_size=8).digest()
+        return int.from_bytes(digest, 'big')
+    
+    def reload_data(self):
+        """重新加载数据（用于获取最新的预测结果）"""
+        with self._lock:
+            self._load_data()
+    
+    def reload_if_changed(self) -> bool:
+        """数据文件的修改时间或大小变化时才重新加载，未变化时只需两次stat"""
+        if self._data_fingerprint() == self._state.generation:
+            return False
+        with self._lock:
+            # 等待锁期间其他线程可能已完成重新加载
+            if self._data_fingerprint() == self._state.generation:
+                return False
+            self._load_data()
+        return True
+    
+    def get_latest_predictions(self) -> Dict[str, Any]:
+        """获取最新的预测结果"""
+        self.reload_if_changed()
+        return self._state.latest_predictions
+    
+    def get_latest_metadata(self) -> Dict[str, Any]:
+        """获取最新预测的元数据"""
+        return self._state.latest_metadata
+    
+    def _init_default_icd_hierarchy(self) -> Dict[str, Any]:
         return {
-            'heart attack': ['myocardial infarction', 'mi', 'acute myocardial infarction', 'cardiac infarction'],
-            'myocardial infarction': ['heart attack', 'mi', 'acute myocardial infarction', 'cardiac infarction'],
-            'mi': ['myocardial infarction', 'heart attack', 'acute myocardial infarction'],
-            'chest pain': ['thoracic pain', 'precordial pain', 'angina'],
-            'shortness of breath': ['dyspnea', 'difficulty breathing', 'breathlessness'],
-            'dyspnea': ['shortness of breath', 'difficulty breathing', 'breathlessness'],
-            'hypertension': ['high blood pressure', 'htn', 'elevated blood pressure'],
-            'htn': ['hypertension', 'high blood pressure'],
-            'diabetes': ['dm', 'diabetes mellitus', 'diabetic'],
-            'dm': ['diabetes', 'diabetes mellitus'],
-            'pneumonia': ['lung infection', 'pulmonary infection', 'respiratory infection'],
-            'fever': ['pyrexia', 'elevated temperature', 'hyperthermia'],
-            'headache': ['cephalgia', 'head pain', 'migraine'],
-            'nausea': ['queasiness', 'feeling sick', 'stomach upset'],
-            'vomiting': ['emesis', 'throwing up', 'regurgitation']
+            "410": {
+                "code": "410",
+                "name": "Acute myocardial infarction",
+                "parent": None,
+                "children": ["410.0", "410.1", "410.7", "410.9"],
+                "level": 1
+            },
+            "410.7": {
+                "code": "410.7",
+                "name": "Subendocardial infarction",
+                "parent": "410",
+                "children": ["410.71"],
+                "level": 2
+            },
+            "410.71": {
+                "code": "410.71",
+                "name": "Subendocardial infarction, initial episode",
+                "parent": "410.7",
+                "children": [],
+                "level": 3
+            }
         }
+    
+    def query_icd(self, icd_code: str) -> Optional[Dict[str, Any]]:
+        """查询ICD编码信息"""
+        return self._state.query_icd(icd_code)
+    
+    def search_icd(self, query: str, limit: int = 10) -> List[Dict[str, Any]]:
+        """按编码或名称搜索ICD编码"""
+        return self._state.search_icd(query, limit)
+    
+    def get_hierarchy_path(self, icd_code: str) -> List[Dict[str, str]]:
+        """获取ICD编码的层次路径"""
+        return self._state.get_hierarchy_path(icd_code)
+    
+    def get_related_nodes(self, icd_code: str, depth: int = 2) -> Dict[str, List[Dict[str, Any]]]:
+        """获取相关节点"""
+        return self._state.get_related_nodes(icd_code, depth)
+    
+    def get_related_nodes_batch(self, icd_codes: List[str], depth: int = 2) -> Dict[str, Any]:
+        """批量获取多个ICD编码的相关节点"""
+        return self._state.get_related_nodes_batch(icd_codes, depth)
+    
+    def filter_icd_by_constraints(self, candidates: List[Dict[str, Any]], constraints: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        """根据语义约束过滤ICD编码"""
+        return self._state.filter_icd_by_constraints(candidates, constraints)
+    
+    def explain_icd_path(self, icd_code: str) -> Dict[str, Any]:
+        """解释ICD编码的知识路径"""
+        return self._state.explain_icd_path(icd_code)
+    
+    def search_semantic_similarity(self, concept: str, threshold: float = 0.7, max_results: int = 10) -> List[Dict[str, Any]]:
+        """语义相似度检索"""
+        return self._state.search_semantic_similarity(concept, threshold, max_results)
+    
+    def _calculate_string_similarity(self, str1: str, str2: str) -> float:
+        """计算字符串相似度"""
+        return _string_similarity(str1, str2)
+    
+    def _get_medical_synonyms(self) -> Dict[str, Tuple[str, ...]]:
+        return _MEDICAL_SYNONYMS
 
 graph_manager = GraphManager()
 
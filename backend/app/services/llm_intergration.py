@@ -1,8 +1,56 @@
 """LLM集成模块"""
-from typing import Dict, Optional, Any
+from typing import Dict, List, Optional, Any
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from app.core.config import settings
 from app.core.logger import logger
+from app.core.utils import TTLCache, json_loads
+
+# LLM响应缓存：同一病例与编码的重复验证/解释直接返回，不再请求API
+_RESPONSE_CACHE_SIZE = 2048
+_RESPONSE_CACHE_TTL = 3600
+
+# 批量调用的并发数，与HTTP会话的连接池大小一致
+_BATCH_CONCURRENCY = 16
+
+
+def _extract_json(text: str) -> Optional[Dict[str, Any]]:
+    """提取响应中第一个完整的JSON对象
+
+    按括号配对扫描（跳过字符串字面量中的括号），支持嵌套对象和多行JSON；
+    找不到或解析失败时返回None。
+    """
+    start = text.find('{')
+    while start != -1:
+        depth = 0
+        in_string = False
+        escaped = False
+        for i in range(start, len(text)):
+            ch = text[i]
+            if in_string:
+                if escaped:
+                    escaped = False
+                elif ch == '\\':
+                    escaped = True
+                elif ch == '"':
+                    in_string = False
+            elif ch == '"':
+                in_string = True
+            elif ch == '{':
+                depth += 1
+            elif ch == '}':
+                depth -= 1
+                if depth == 0:
+                    try:
+                        result = json_loads(text[start:i + 1])
+                    except ValueError:
+                        break
+                    return result if isinstance(result, dict) else None
+        start = text.find('{', start + 1)
+    return None
 
 
 class LLMIntegration:
@@ -13,6 +61,36 @@ class LLMIntegration:
         self.model = settings.LLM_MODEL
         self.api_key = settings.LLM_API_KEY
         self.base_url = settings.LLM_BASE_URL or self._get_default_base_url()
+        self._response_cache = TTLCache(_RESPONSE_CACHE_SIZE, _RESPONSE_CACHE_TTL)
+        self.session = self._create_session()
+        self._executor = ThreadPoolExecutor(max_workers=_BATCH_CONCURRENCY, thread_name_prefix='llm')
+    
+    @staticmethod
+    def _create_session() -> requests.Session:
+        """创建复用连接的HTTP会话：保持长连接，省去每次调用的TCP/TLS握手
+        
+        补全请求按量计费且不幂等，只重试确定未被处理的情况：连接失败，以及按 Retry-After 等待后的 429/503；
+        读超时和其他5xx可能已生成结果，不重试
+        """
+        session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=8,
+            pool_maxsize=_BATCH_CONCURRENCY,
+            max_retries=Retry(
+                total=3,
+                connect=3,
+                read=0,
+                other=0,
+                backoff_factor=0.3,
+                status_forcelist=[429, 503],
+                allowed_methods=frozenset(['POST']),
+                respect_retry_after_header=True
+            )
+        )
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        session.headers.update({"Content-Type": "application/json"})
+        return session
     
     def _get_default_base_url(self) -> str:
         """获取默认API地址"""
@@ -23,31 +101,53 @@ class LLMIntegration:
         else:
             return "http://localhost:8000/v1"  # 本地LLM服务
     
-    def _call_llm(self, prompt: str, system_prompt: Optional[str] = None) -> str:
-        """调用LLM API"""
+    def _cache_key(self, prompt: str, system_prompt: Optional[str], stream: bool = False) -> bytes:
+        """按提供者、模型和提示词计算缓存键（流式截断的响应单独缓存）"""
+        raw = f"{self.provider}|{self.model}|{int(stream)}|{system_prompt or ''}|{prompt}".encode('utf-8')
+        return hashlib.blake2b(raw, digest_size=16).digest()
+    
+    def _call_llm(
+        self,
+        prompt: str,
+        system_prompt: Optional[str] = None,
+        cache: bool = True,
+        stream: bool = False
+    ) -> str:
+        """调用LLM API（cache=False 时跳过响应缓存）
+
+        stream=True 时以流式方式接收，读到第一个完整的JSON对象即停止，
+        适用于只需要开头JSON结果的验证请求（仅OpenAI兼容接口支持，其余提供者忽略）。
+        """
         # 模拟实现（实际应该调用真实的LLM API）
         if not self.api_key:
             logger.warning("LLM API Key未配置，使用模拟响应")
             return self._mock_llm_response(prompt)
         
+        key = self._cache_key(prompt, system_prompt, stream) if cache else None
+        if key is not None:
+            cached = self._response_cache.get(key)
+            if cached is not None:
+                return cached
+        
         try:
             if self.provider == "openai":
-                return self._call_openai(prompt, system_prompt)
+                response = self._call_openai(prompt, system_prompt, stream)
             elif self.provider == "anthropic":
-                return self._call_anthropic(prompt, system_prompt)
+                response = self._call_anthropic(prompt, system_prompt)
             else:
-                return self._call_local_llm(prompt, system_prompt)
+                response = self._call_local_llm(prompt, system_prompt, stream)
+            # 只缓存API的正常响应，失败时的模拟响应不缓存
+            if key is not None:
+                self._response_cache.set(key, response)
+            return response
         except Exception as e:
             logger.error(f"LLM调用失败: {str(e)}")
             return self._mock_llm_response(prompt)
     
-    def _call_openai(self, prompt: str, system_prompt: Optional[str] = None) -> str:
+    def _call_openai(self, prompt: str, system_prompt: Optional[str] = None, stream: bool = False) -> str:
         """调用OpenAI API"""
         url = f"{self.base_url}/chat/completions"
-        headers = {
-            "Authorization": f"Bearer {self.api_key}",
-            "Content-Type": "application/json"
-        }
+        headers = {"Authorization": f"Bearer {self.api_key}"}
         
         messages = []
         if system_prompt:
@@ -61,7 +161,9 @@ class LLMIntegration:
             "max_tokens": 1000
         }
         
-        response = requests.post(url, headers=headers, json=data, timeout=30)
+        if stream:
+            return self._stream_chat_completion(url, data, headers=headers, timeout=30)
+        response = self.session.post(url, headers=headers, json=data, timeout=30)
         response.raise_for_status()
         result = response.json()
         return result['choices'][0]['message']['content']
@@ -71,8 +173,7 @@ class LLMIntegration:
         url = f"{self.base_url}/messages"
         headers = {
             "x-api-key": self.api_key,
-            "anthropic-version": "2023-06-01",
-            "Content-Type": "application/json"
+            "anthropic-version": "2023-06-01"
         }
         
         data = {
@@ -84,16 +185,14 @@ class LLMIntegration:
         if system_prompt:
             data["system"] = system_prompt
         
-        response = requests.post(url, headers=headers, json=data, timeout=30)
+        response = self.session.post(url, headers=headers, json=data, timeout=30)
         response.raise_for_status()
         result = response.json()
         return result['content'][0]['text']
     
-    def _call_local_llm(self, prompt: str, system_prompt: Optional[str] = None) -> str:
+    def _call_local_llm(self, prompt: str, system_prompt: Optional[str] = None, stream: bool = False) -> str:
         """调用本地LLM服务"""
         url = f"{self.base_url}/chat/completions"
-        headers = {"Content-Type": "application/json"}
-        
         messages = []
         if system_prompt:
             messages.append({"role": "system", "content": system_prompt})
@@ -105,11 +204,40 @@ class LLMIntegration:
             "temperature": 0.7
         }
         
-        response = requests.post(url, headers=headers, json=data, timeout=60)
+        if stream:
+            return self._stream_chat_completion(url, data, timeout=60)
+        response = self.session.post(url, json=data, timeout=60)
         response.raise_for_status()
         result = response.json()
         return result['choices'][0]['message']['content']
     
+    def _stream_chat_completion(
+        self,
+        url: str,
+        data: Dict[str, Any],
+        headers: Optional[Dict[str, str]] = None,
+        timeout: float = 30
+    ) -> str:
+        """以SSE流式调用chat/completions接口，拼接到出现完整JSON对象后提前断开"""
+        parts: List[str] = []
+        with self.session.post(url, headers=headers, json={**data, "stream": True}, timeout=timeout, stream=True) as response:
+            response.raise_for_status()
+            for line in response.iter_lines():
+                if not line.startswith(b'data:'):
+                    continue
+                payload = line[5:].strip()
+                if payload == b'[DONE]':
+                    break
+                choices = json_loads(payload).get('choices') or [{}]
+                content = (choices[0].get('delta') or {}).get('content')
+                if not content:
+                    continue
+                parts.append(content)
+                # 只在收到右括号时尝试解析，避免每个分片都扫描全文
+                if '}' in content and _extract_json(''.join(parts)) is not None:
+                    break
+        return ''.join(parts)
+    
     def _mock_llm_response(self, prompt: str) -> str:
         """模拟LLM响应（当API不可用时）"""
         if "验证" in prompt or "verify" in prompt.lower():
@@ -150,17 +278,11 @@ class LLMIntegration:
 """
         
         try:
-            response = self._call_llm(prompt, system_prompt)
-            
-            # 尝试解析JSON响应
-            import json
-            import re
+            response = self._call_llm(prompt, system_prompt, stream=True)
             
-            # 提取JSON部分
-            json_match = re.search(r'\{[^}]+\}', response)
-            if json_match:
-                result = json.loads(json_match.group())
-            else:
+            # 提取并解析JSON部分
+            result = _extract_json(response)
+            if result is None:
                 # 如果不能解析JSON，使用启发式方法
                 result = {
                     "is_valid": "是" in response or "合理" in response or "匹配" in response,
@@ -228,7 +350,18 @@ ICD名称：{icd_name or '未知'}
                 'generated': False,
                 'error': str(e)
             }
-
+    
+    def verify_batch(self, items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """批量验证（items中每个元素为verify的关键字参数），各请求并发发出，结果按输入顺序返回"""
+        if len(items) <= 1:
+            return [self.verify(**item) for item in items]
+        return list(self._executor.map(lambda item: self.verify(**item), items))
+    
+    def explain_batch(self, items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """批量生成解释（items中每个元素为explain的关键字参数），各请求并发发出"""
+        if len(items) <= 1:
+            return [self.explain(**item) for item in items]
+        return list(self._executor.map(lambda item: self.explain(**item), items))
 
 # 全局LLM集成实例
 llm_integration = LLMIntegration()
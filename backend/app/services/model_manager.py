@@ -1,7 +1,8 @@
 """模型管理模块（简化版，仅用于测试）"""
-from typing import Dict, List, Optional, Any
+from typing import Dict, List, Optional, Any, Tuple
 from app.core.config import settings
 from app.core.logger import logger
+from app.tests.mock_predict import mock_predictor
 
 
 class ModelManager:
@@ -30,35 +31,22 @@ class ModelManager:
         top_k: int = None
     ) -> Dict[str, Any]:
         """使用测试数据进行预测"""
-        from app.tests.mock_predict import mock_predictor
         logger.info(f"ModelManager: 使用测试预测模式")
+        results, _ = self._run_mock(top_k)
+        return self._prediction_output(model_name or self.current_model, preprocessed_text, results)
+    
+    def predict_batch(
+        self,
+        preprocessed_texts: List[Dict[str, Any]],
+        model_name: Optional[str] = None,
+        top_k: int = None
+    ) -> List[Dict[str, Any]]:
+        """批量预测（测试模式），模拟结果与输入无关，整批只取一次"""
+        logger.info(f"ModelManager: 使用测试预测模式批量预测 {len(preprocessed_texts)} 个病例")
         
-        original_text = preprocessed_text.get('original_text', '') or preprocessed_text.get('preprocessed_text', '')
-        top_k = top_k or settings.TOP_K
-        threshold = settings.PREDICTION_THRESHOLD
-        
-        mock_result = mock_predictor.predict(
-            original_text, 
-            model=model_name or self.current_model, 
-            top_k=top_k, 
-            threshold=threshold
-        )
-        
-        results = []
-        for pred in mock_result.get('icdPredictions', []):
-            results.append({
-                'icd_code': pred.get('code', ''),
-                'icd_name': pred.get('description', ''),
-                'probability': pred.get('probability', 0.0)
-            })
-        
-        return {
-            'model': model_name or self.current_model,
-            'text': preprocessed_text.get('preprocessed_text', ''),
-            'results': results,
-            'total': len(results),
-            'mock_mode': True
-        }
+        model = model_name or self.current_model
+        results, _ = self._run_mock(top_k)
+        return [self._prediction_output(model, preprocessed, list(results)) for preprocessed in preprocessed_texts]
     
     def collaborative_reasoning(
         self,
@@ -71,30 +59,10 @@ class ModelManager:
         low_confidence_threshold: float = 0.6
     ) -> Dict[str, Any]:
         """协同推理（测试模式）"""
-        from app.tests.mock_predict import mock_predictor
         logger.info(f"ModelManager: 使用测试预测模式进行协同推理")
         
-        original_text = preprocessed_text.get('original_text', '') or preprocessed_text.get('preprocessed_text', '')
-        top_k = settings.TOP_K
-        threshold = settings.PREDICTION_THRESHOLD
-        
         model_names = model_names or [self.current_model]
-        mock_result = mock_predictor.predict(
-            original_text, 
-            model=model_names[0] if model_names else self.current_model, 
-            top_k=top_k, 
-            threshold=threshold
-        )
-        
-        results = []
-        for pred in mock_result.get('icdPredictions', []):
-            results.append({
-                'icd_code': pred.get('code', ''),
-                'icd_name': pred.get('description', ''),
-                'probability': pred.get('probability', 0.0)
-            })
-        
-        avg_confidence = mock_result.get('avgConfidence', 0.0)
+        results, avg_confidence = self._run_mock(settings.TOP_K)
         
         return {
             'models_used': model_names,
@@ -108,6 +76,26 @@ class ModelManager:
             'llm_candidates_generated': False,
             'mock_mode': True
         }
+    
+    @staticmethod
+    def _run_mock(top_k: Optional[int] = None) -> Tuple[List[Dict[str, Any]], float]:
+        """各预测入口共用的模拟预测：返回 (结果列表, 平均置信度)
+        
+        模拟预测与输入文本无关，直接取预先构建的结果。
+        """
+        results = mock_predictor.predict_results(top_k or settings.TOP_K, settings.PREDICTION_THRESHOLD)
+        return results, mock_predictor.average_confidence(len(results))
+    
+    @staticmethod
+    def _prediction_output(model: str, preprocessed_text: Dict[str, Any], results: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """单模型预测的返回格式"""
+        return {
+            'model': model,
+            'text': preprocessed_text.get('preprocessed_text', ''),
+            'results': results,
+            'total': len(results),
+            'mock_mode': True
+        }
 
 
 model_manager = ModelManager()
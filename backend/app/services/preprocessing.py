@@ -1,97 +1,152 @@
 """数据预处理模块"""
 import re
-from typing import Dict, List, Optional, Any
+from functools import lru_cache
+from typing import Dict, List, Optional, Any, Tuple
 from app.core.config import settings
 from app.core.logger import logger
 
+# 停用词表
+MEDICAL_STOPWORDS = frozenset({
+    'the', 'a', 'an', 'and', 'or', 'but', 'in', 'on', 'at', 'to', 'for',
+    'of', 'with', 'by', 'is', 'are', 'was', 'were', 'be', 'been', 'being',
+    'have', 'has', 'had', 'do', 'does', 'did', 'will', 'would', 'should',
+    'could', 'may', 'might', 'can', 'this', 'that', 'these', 'those'
+})
+
+# 清洗用正则，导入时编译一次
+_NON_WORD_KEEP_NUMBERS_RE = re.compile(r'[^\w\s\.\-]')
+_NON_WORD_RE = re.compile(r'[^\w\s]')
+_WHITESPACE_RE = re.compile(r'\s+')
+# ASCII文本走str.translate：按上面两个正则逐个判定128个ASCII字符，得到等价的替换表
+_NON_WORD_KEEP_NUMBERS_TABLE = str.maketrans({
+    chr(c): ' ' for c in range(128) if _NON_WORD_KEEP_NUMBERS_RE.match(chr(c))
+})
+_NON_WORD_TABLE = str.maketrans({chr(c): ' ' for c in range(128) if _NON_WORD_RE.match(chr(c))})
+
+# 缩写到标准术语的映射；所有缩写合并为一个交替模式，一次扫描完成替换
+_TERM_MAPPINGS = {
+    'mi': 'myocardial infarction',
+    'cad': 'coronary artery disease',
+    'chf': 'congestive heart failure',
+    'copd': 'chronic obstructive pulmonary disease',
+    'dm': 'diabetes mellitus',
+    'htn': 'hypertension',
+    'afib': 'atrial fibrillation',
+}
+_TERM_RE = re.compile(r'\b(' + '|'.join(map(re.escape, _TERM_MAPPINGS)) + r')\b', re.IGNORECASE)
+
+# 医学实体关键词表（按类别），导入时构建一次
+# 关键词之间存在重叠（如 pain / chest pain），按子串逐个判断；str 的子串查找在C中完成，
+# 对短文本比合并成一个带前瞻的交替正则逐位置匹配更快
+_ENTITY_KEYWORDS: Dict[str, Tuple[str, ...]] = {
+    'diseases': (
+        'disease', 'disorder', 'syndrome', 'infection', 'inflammation', 'cancer', 'tumor', 'carcinoma',
+        'diabetes', 'hypertension', 'pneumonia', 'bronchitis', 'asthma', 'copd'
+    ),
+    'symptoms': (
+        'pain', 'ache', 'fever', 'cough', 'shortness', 'breath', 'nausea', 'vomiting', 'diarrhea',
+        'fatigue', 'weakness', 'headache', 'dizziness', 'chest pain', 'abdominal pain'
+    ),
+    'procedures': (
+        'surgery', 'operation', 'procedure', 'biopsy', 'examination', 'test', 'scan', 'x-ray',
+        'ct', 'mri', 'ultrasound'
+    ),
+    'medications': (),
+}
+
+
+# 界面提交的病历常复用主诉模板等固定片段，清洗和术语标准化都是输入字符串的纯函数，按参数缓存
+@lru_cache(maxsize=2048)
+def _clean_lowered_text(text: str, keep_numbers: bool, max_length: int) -> Tuple[str, bool]:
+    """清洗已转为小写的文本，返回 (清洗结果, 是否被截断)；截断警告由调用方记录，缓存命中时照常输出"""
+    if text.isascii():
+        text = text.translate(_NON_WORD_KEEP_NUMBERS_TABLE if keep_numbers else _NON_WORD_TABLE)
+    elif keep_numbers:
+        text = _NON_WORD_KEEP_NUMBERS_RE.sub(' ', text)
+    else:
+        text = _NON_WORD_RE.sub(' ', text)
+    text = _WHITESPACE_RE.sub(' ', text)
+    truncated = len(text) > max_length
+    if truncated:
+        text = text[:max_length]
+    return text.strip(), truncated
+
+
+@lru_cache(maxsize=2048)
+def _standardize_terms(text: str) -> str:
+    """术语标准化"""
+    return _TERM_RE.sub(lambda m: _TERM_MAPPINGS[m.group(1).lower()], text)
+
 
 class TextPreprocessor:
     """文本预处理器"""
     
-    MEDICAL_STOPWORDS = {
-        'the', 'a', 'an', 'and', 'or', 'but', 'in', 'on', 'at', 'to', 'for',
-        'of', 'with', 'by', 'is', 'are', 'was', 'were', 'be', 'been', 'being',
-        'have', 'has', 'had', 'do', 'does', 'did', 'will', 'would', 'should',
-        'could', 'may', 'might', 'can', 'this', 'that', 'these', 'those'
-    }
+    MEDICAL_STOPWORDS = MEDICAL_STOPWORDS
     
     def __init__(self):
         self.max_length = settings.MAX_TEXT_LENGTH
         self.remove_stopwords = settings.REMOVE_STOPWORDS
         self.keep_numbers = settings.KEEP_NUMBERS
+        # 预处理结果缓存（同一文本常被/explain、/explain/attention、/explain/graph先后提交）
+        # 键包含影响结果的配置项，修改配置后不会命中旧结果；返回的字典在调用方之间共享，只读使用
+        self._preprocess_cache = lru_cache(maxsize=4096)(self._preprocess)
     
     def clean_text(self, text: str) -> str:
         """文本清洗"""
         if not text:
             return ""
-        text = text.lower()
-        if self.keep_numbers:
-            text = re.sub(r'[^\w\s\.\-]', ' ', text)
-        else:
-            text = re.sub(r'[^\w\s]', ' ', text)
-        text = re.sub(r'\s+', ' ', text)
-        if len(text) > self.max_length:
-            text = text[:self.max_length]
+        return self._clean_lowered(text.lower())
+    
+    def _clean_lowered(self, text: str) -> str:
+        """清洗已转为小写的文本"""
+        text, truncated = _clean_lowered_text(text, self.keep_numbers, self.max_length)
+        if truncated:
             logger.warning(f"文本被截断到 {self.max_length} 字符")
-        return text.strip()
+        return text
     
     def tokenize(self, text: str) -> List[str]:
         """分词"""
-        tokens = text.split()
-        if self.remove_stopwords:
-            tokens = [t for t in tokens if t not in self.MEDICAL_STOPWORDS]
-        return tokens
+        if not self.remove_stopwords:
+            return text.split()
+        stopwords = MEDICAL_STOPWORDS
+        return [t for t in text.split() if t not in stopwords]
     
     def standardize_terms(self, text: str) -> str:
         """术语标准化"""
-        term_mappings = {
-            'mi': 'myocardial infarction',
-            'cad': 'coronary artery disease',
-            'chf': 'congestive heart failure',
-            'copd': 'chronic obstructive pulmonary disease',
-            'dm': 'diabetes mellitus',
-            'htn': 'hypertension',
-            'afib': 'atrial fibrillation',
-        }
-        
-        standardized = text
-        for abbrev, full_term in term_mappings.items():
-            pattern = r'\b' + re.escape(abbrev) + r'\b'
-            standardized = re.sub(pattern, full_term, standardized, flags=re.IGNORECASE)
-        
-        return standardized
+        return _standardize_terms(text)
     
     def extract_medical_entities(self, text: str) -> Dict[str, List[str]]:
-        """医学实体识别"""
-        entities = {'diseases': [], 'symptoms': [], 'procedures': [], 'medications': []}
-        disease_keywords = ['disease', 'disorder', 'syndrome', 'infection', 'inflammation', 'cancer', 'tumor', 'carcinoma', 'diabetes', 'hypertension', 'pneumonia', 'bronchitis', 'asthma', 'copd']
-        symptom_keywords = ['pain', 'ache', 'fever', 'cough', 'shortness', 'breath', 'nausea', 'vomiting', 'diarrhea', 'fatigue', 'weakness', 'headache', 'dizziness', 'chest pain', 'abdominal pain']
-        procedure_keywords = ['surgery', 'operation', 'procedure', 'biopsy', 'examination', 'test', 'scan', 'x-ray', 'ct', 'mri', 'ultrasound']
-        
-        text_lower = text.lower()
-        tokens = self.tokenize(text)
-        
-        for keyword in disease_keywords:
-            if keyword in text_lower:
-                entities['diseases'].append(keyword)
-        for keyword in symptom_keywords:
-            if keyword in text_lower:
-                entities['symptoms'].append(keyword)
-        for keyword in procedure_keywords:
-            if keyword in text_lower:
-                entities['procedures'].append(keyword)
-        
-        for key in entities:
-            entities[key] = list(set(entities[key]))
-        return entities
+        """医学实体识别（按关键词表顺序输出文本中出现的关键词）"""
+        return self._match_entities(text.lower())
+    
+    @staticmethod
+    def _match_entities(text_lower: str) -> Dict[str, List[str]]:
+        """在已转为小写的文本中匹配实体关键词"""
+        return {
+            category: [keyword for keyword in keywords if keyword in text_lower]
+            for category, keywords in _ENTITY_KEYWORDS.items()
+        }
     
     def preprocess(self, text: str) -> Dict[str, Any]:
         """完整预处理流程"""
+        return self._preprocess_cache(text, (self.max_length, self.remove_stopwords, self.keep_numbers))
+    
+    def clear_cache(self) -> None:
+        """清空预处理结果缓存"""
+        self._preprocess_cache.cache_clear()
+        _clean_lowered_text.cache_clear()
+        _standardize_terms.cache_clear()
+    
+    def _preprocess(self, text: str, config: Tuple[int, bool, bool]) -> Dict[str, Any]:
+        # config 只参与缓存键，处理时直接读取实例配置
         try:
-            cleaned = self.clean_text(text)
+            # 清洗和实体识别共用同一次小写转换；实体在截断前的完整文本上识别
+            text_lower = text.lower()
+            cleaned = self._clean_lowered(text_lower) if text else ""
             standardized = self.standardize_terms(cleaned)
-            tokens = self.tokenize(standardized)
-            entities = self.extract_medical_entities(text)
+            # tokens 以元组返回，缓存结果在调用方之间共享时不会被修改
+            tokens = tuple(self.tokenize(standardized))
+            entities = self._match_entities(text_lower)
             
             return {
                 'original_text': text,
@@ -100,11 +155,16 @@ class TextPreprocessor:
                 'tokens': tokens,
                 'entities': entities,
                 'token_count': len(tokens),
-                'preprocessed_text': ' '.join(tokens)
+                # 清洗后空白已折叠为单个空格，不去停用词时分词再拼接与标准化文本相同，直接复用
+                'preprocessed_text': ' '.join(tokens) if self.remove_stopwords else standardized
             }
         except Exception as e:
             logger.error(f"预处理失败: {str(e)}")
             raise
+    
+    def preprocess_batch(self, texts: List[str]) -> List[Dict[str, Any]]:
+        """批量预处理"""
+        return [self.preprocess(text) for text in texts]
 
 preprocessor = TextPreprocessor()
 
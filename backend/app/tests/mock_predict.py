@@ -1,14 +1,19 @@
 
+import bisect
+import sys
+from functools import lru_cache
+from itertools import accumulate
 from typing import Dict, List, Any, Optional
 from datetime import datetime
+from time import perf_counter_ns
 from app.core.logger import logger
 
 
 class MockPredictor:
 
     
-    # 模拟的ICD预测结果
-    MOCK_PREDICTIONS = [
+    # 模拟的ICD预测结果（常量数据使用元组，各请求共享同一份）
+    MOCK_PREDICTIONS = (
         {
             'code': '410.71',
             'description': 'Subendocardial infarction',
@@ -59,18 +64,18 @@ class MockPredictor:
             'description': 'Aortic valve disorders',
             'probability': 0.35
         }
-    ]
+    )
     
     # 模拟的实体识别结果
     MOCK_ENTITIES = {
-        'diseases': ['myocardial infarction', 'heart failure', 'coronary artery disease'],
-        'symptoms': ['chest pain', 'shortness of breath', 'fatigue'],
-        'procedures': ['echocardiogram', 'cardiac catheterization', 'ecg'],
-        'medications': ['aspirin', 'atorvastatin', 'metoprolol']
+        'diseases': ('myocardial infarction', 'heart failure', 'coronary artery disease'),
+        'symptoms': ('chest pain', 'shortness of breath', 'fatigue'),
+        'procedures': ('echocardiogram', 'cardiac catheterization', 'ecg'),
+        'medications': ('aspirin', 'atorvastatin', 'metoprolol')
     }
     
     # 模拟的关键词热度
-    MOCK_KEYWORD_HEATMAP = [
+    MOCK_KEYWORD_HEATMAP = (
         {'term': 'chest pain', 'importance': 0.95},
         {'term': 'myocardial infarction', 'importance': 0.89},
         {'term': 'shortness of breath', 'importance': 0.82},
@@ -81,10 +86,10 @@ class MockPredictor:
         {'term': 'heart failure', 'importance': 0.61},
         {'term': 'ejection fraction', 'importance': 0.58},
         {'term': 'cardiac enzymes', 'importance': 0.55}
-    ]
+    )
     
     # 模拟的特征重要性
-    MOCK_FEATURE_IMPORTANCE = [
+    MOCK_FEATURE_IMPORTANCE = (
         {'name': 'chest pain', 'score': 0.92},
         {'name': 'st elevation', 'score': 0.87},
         {'name': 'troponin elevated', 'score': 0.83},
@@ -95,10 +100,10 @@ class MockPredictor:
         {'name': 'hypotension', 'score': 0.62},
         {'name': 'arrhythmia', 'score': 0.59},
         {'name': 'elevated bnp', 'score': 0.56}
-    ]
+    )
     
     # 模拟的决策路径
-    MOCK_DECISION_PATH = [
+    MOCK_DECISION_PATH = (
         {
             'description': '数据预处理：文本清洗、分词、标准化',
             'confidence': 1.0
@@ -123,39 +128,56 @@ class MockPredictor:
             'description': '结果融合：多模型协同推理，融合最终结果',
             'confidence': 0.85
         }
-    ]
+    )
     
     @staticmethod
     def predict(case_text: str, model: Optional[str] = None, top_k: int = 10, threshold: float = 0.5) -> Dict[str, Any]:
 
-        import time
-        start_time = time.time()
+        start_time = perf_counter_ns()
         
-        # 过滤并截取结果
-        filtered_predictions = [
-            pred for pred in MockPredictor.MOCK_PREDICTIONS
-            if pred['probability'] >= threshold
-        ][:top_k]
+        # 过滤并截取结果：预测按概率降序预排，二分查找阈值的截断位置
+        cut = bisect.bisect_right(MockPredictor._NEG_PROBABILITIES, -threshold)
+        filtered_predictions = list(MockPredictor._SORTED_PREDICTIONS[:cut][:top_k])
         
-        # 计算平均置信度
-        avg_confidence = sum(p['probability'] for p in filtered_predictions) / len(filtered_predictions) if filtered_predictions else 0
+        # 计算平均置信度（结果总是排序后列表的前缀，直接取前缀和）
+        avg_confidence = MockPredictor.average_confidence(len(filtered_predictions))
         
         # 生成响应
-        response = {
+        response = MockPredictor._build_response(
+            case_text,
+            filtered_predictions,
+            avg_confidence,
+            (perf_counter_ns() - start_time) // 1_000_000,
+            model
+        )
+        
+        logger.info(f"模拟预测完成，返回 {len(filtered_predictions)} 个结果")
+        return response
+    
+    @staticmethod
+    def _build_response(
+        case_text: str,
+        filtered_predictions: List[Dict[str, Any]],
+        avg_confidence: float,
+        processing_time: int,
+        model: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """组装单个病例的模拟预测响应（predict 与 predict_batch 共用）"""
+        return {
             # 实体识别结果
             'entities': MockPredictor.MOCK_ENTITIES,
-            'entityCount': sum(len(v) for v in MockPredictor.MOCK_ENTITIES.values()),
+            'entityCount': MockPredictor._ENTITY_COUNT,
             
             # ICD预测结果
             'icdPredictions': filtered_predictions,
             
             # 统计数据
-            'avgConfidence': round(avg_confidence, 3),
-            'processingTime': int((time.time() - start_time) * 1000),
+            'avgConfidence': avg_confidence,
+            'processingTime': processing_time,
             
             # 可解释性数据
-            'keywordHeatmap': MockPredictor.MOCK_KEYWORD_HEATMAP[:10],
-            'featureImportance': MockPredictor.MOCK_FEATURE_IMPORTANCE[:10],
+            'keywordHeatmap': MockPredictor._KEYWORD_HEATMAP_TOP,
+            'featureImportance': MockPredictor._FEATURE_IMPORTANCE_TOP,
             
             # 决策路径
             'decisionPath': MockPredictor.MOCK_DECISION_PATH,
@@ -169,42 +191,105 @@ class MockPredictor:
             'isMock': True,
             'mockMode': True
         }
+    
+    @staticmethod
+    def predict_results(top_k: int = 10, threshold: float = 0.5) -> List[Dict[str, Any]]:
+        """ModelManager结果格式的模拟预测（字典预先构建，各请求共享，只读使用）"""
+        cut = bisect.bisect_right(MockPredictor._NEG_PROBABILITIES, -threshold)
+        return list(MockPredictor._RESULT_PREDICTIONS[:cut][:top_k])
+    
+    @staticmethod
+    def average_confidence(count: int) -> float:
+        """前count个预测的平均置信度（保留三位小数）"""
+        return round(MockPredictor._PROBABILITY_PREFIX_SUMS[count] / count, 3) if count else 0
+    
+    @staticmethod
+    def predict_batch(
+        case_texts: List[str],
+        model: Optional[str] = None,
+        top_k: int = 10,
+        threshold: float = 0.5
+    ) -> List[Dict[str, Any]]:
+        """批量模拟预测：预测结果与输入文本无关，过滤和统计整批只计算一次"""
+        start_time = perf_counter_ns()
         
-        logger.info(f"模拟预测完成，返回 {len(filtered_predictions)} 个结果")
-        return response
+        cut = bisect.bisect_right(MockPredictor._NEG_PROBABILITIES, -threshold)
+        filtered_predictions = MockPredictor._SORTED_PREDICTIONS[:cut][:top_k]
+        count = len(filtered_predictions)
+        avg_confidence = MockPredictor.average_confidence(count)
+        processing_time = (perf_counter_ns() - start_time) // 1_000_000
+        
+        responses = [
+            MockPredictor._build_response(case_text, list(filtered_predictions), avg_confidence, processing_time, model)
+            for case_text in case_texts
+        ]
+        
+        logger.info(f"批量模拟预测完成，{len(case_texts)} 个病例各返回 {count} 个结果")
+        return responses
     
     @staticmethod
     def get_graph_data(icd_code: str) -> Dict[str, Any]:
 
-        mock_graph_data = {
-            'nodes': [
-                {'id': '410', 'label': 'Acute myocardial infarction', 'level': 1},
-                {'id': '410.7', 'label': 'Subendocardial infarction', 'level': 2},
-                {'id': '410.71', 'label': 'Subendocardial infarction, initial episode', 'level': 3}
-            ],
-            'edges': [
-                {'source': '410', 'target': '410.7', 'type': 'parent-child'},
-                {'source': '410.7', 'target': '410.71', 'type': 'parent-child'}
-            ]
-        }
-        return mock_graph_data
+        # 返回外层字典的浅拷贝，嵌套数据为各调用共享的元组
+        return dict(_mock_graph_data(icd_code))
     
     @staticmethod
     def get_explain_data(icd_code: str) -> Dict[str, Any]:
 
-        mock_explain_data = {
-            'icd_code': icd_code,
-            'icd_name': 'Subendocardial infarction, initial episode',
-            'explanation': f'该ICD编码 {icd_code} 表示心内膜下心肌梗死，首次发作。',
-            'related_codes': [
-                {'code': '410', 'name': 'Acute myocardial infarction', 'relation': 'parent'},
-                {'code': '410.7', 'name': 'Subendocardial infarction', 'relation': 'parent'}
-            ],
-            'keywords': ['chest pain', 'st elevation', 'troponin'],
-            'confidence': 0.89
-        }
-        return mock_explain_data
+        return dict(_mock_explain_data(icd_code))
+
 
+@lru_cache(maxsize=1024)
+def _mock_graph_data(icd_code: str) -> Dict[str, Any]:
+    """按ICD编码缓存的模拟图谱数据"""
+    return {
+        'nodes': (
+            {'id': '410', 'label': 'Acute myocardial infarction', 'level': 1},
+            {'id': '410.7', 'label': 'Subendocardial infarction', 'level': 2},
+            {'id': '410.71', 'label': 'Subendocardial infarction, initial episode', 'level': 3}
+        ),
+        'edges': (
+            {'source': '410', 'target': '410.7', 'type': 'parent-child'},
+            {'source': '410.7', 'target': '410.71', 'type': 'parent-child'}
+        )
+    }
+
+
+@lru_cache(maxsize=1024)
+def _mock_explain_data(icd_code: str) -> Dict[str, Any]:
+    """按ICD编码缓存的模拟解释数据"""
+    return {
+        'icd_code': icd_code,
+        'icd_name': 'Subendocardial infarction, initial episode',
+        'explanation': f'该ICD编码 {icd_code} 表示心内膜下心肌梗死，首次发作。',
+        'related_codes': (
+            {'code': '410', 'name': 'Acute myocardial infarction', 'relation': 'parent'},
+            {'code': '410.7', 'name': 'Subendocardial infarction', 'relation': 'parent'}
+        ),
+        'keywords': ('chest pain', 'st elevation', 'troponin'),
+        'confidence': 0.89
+    }
+
+
+# 由常量数据派生的响应字段，定义类时计算一次
+MockPredictor._ENTITY_COUNT = sum(len(v) for v in MockPredictor.MOCK_ENTITIES.values())
+MockPredictor._KEYWORD_HEATMAP_TOP = MockPredictor.MOCK_KEYWORD_HEATMAP[:10]
+MockPredictor._FEATURE_IMPORTANCE_TOP = MockPredictor.MOCK_FEATURE_IMPORTANCE[:10]
+MockPredictor._SORTED_PREDICTIONS = tuple(
+    sorted(MockPredictor.MOCK_PREDICTIONS, key=lambda p: p['probability'], reverse=True)
+)
+MockPredictor._RESULT_PREDICTIONS = tuple(
+    {
+        'icd_code': sys.intern(p.get('code', '')),
+        'icd_name': p.get('description', ''),
+        'probability': p.get('probability', 0.0)
+    }
+    for p in MockPredictor._SORTED_PREDICTIONS
+)
+MockPredictor._NEG_PROBABILITIES = [-p['probability'] for p in MockPredictor._SORTED_PREDICTIONS]
+MockPredictor._PROBABILITY_PREFIX_SUMS = list(
+    accumulate((p['probability'] for p in MockPredictor._SORTED_PREDICTIONS), initial=0)
+)
 
 # 全局模拟预测器实例
 mock_predictor = MockPredictor()